@@ -48,29 +48,77 @@ For further details, please consult the associated paper.
 
 # @title Codes For Mel2Word
 
-from music21 import *
 import numpy as np
+import os
+import hashlib
 from os import listdir
 from os.path import isfile, join
-from collections import Counter
+from collections import Counter, deque, namedtuple
+from collections.abc import Mapping, Sequence
+import math
+import mmap
+import struct
+import gc
+import heapq
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial, wraps
+from multiprocessing import Pipe, Process
 import pickle
-import mel2word
+import subprocess
+import sys
 import warnings
-from music21 import exceptions21
-warnings.filterwarnings("ignore", category=exceptions21.Music21DeprecationWarning)
+import contextlib
+import io
+import json
+import platform
+import tempfile
+import time
+import tracemalloc
+import inspect
+
+
+# music21, WordCloud, matplotlib, scikit-learn and gensim take seconds to import, so they are only loaded on
+# first use. The conversion, dictionary and tokenization APIs work without loading the plotting stacks, and
+# the 'raw' MIDI engine works without music21.
+@lru_cache(maxsize=None)
+def _import_music21():
+    """
+    Imports music21 on first use and silences its deprecation warnings.
+    """
+    import music21
+    from music21 import exceptions21
+    warnings.filterwarnings("ignore", category=exceptions21.Music21DeprecationWarning)
+    return music21
+
+# Clipping ranges of the pitch intervals (semitones) and IOIs (beats)
+PITCH_INTERVAL_RANGE = (-12, 12)
+IOI_RANGE = (0, 4)
 
 
-def get_midi(midi_name, melody_program=0):
+def get_midi(midi_name, melody_program=0, engine='music21'):
     """
     Extracts the melody from a MIDI file using music21.
 
     Parameters:
     - midi_name (str): Path to the MIDI file.
     - melody_program (int, optional): The instrument index to extract. Defaults to 0.
+    - engine (str, optional): 'music21' builds a full music21 stream; 'raw' reads the note events
+      directly from the MIDI bytes (see `get_midi_raw()`). Defaults to 'music21'.
 
     Returns:
-    - list: The extracted melody notes (music21 note objects).
+    - list: The extracted melody notes (music21 note objects, or RawNote tuples for the 'raw' engine).
+      Simultaneous notes are gathered into one chord only when they also end together; otherwise they
+      are returned as separate notes.
     """
+    if engine == 'raw':
+        return get_midi_raw(midi_name, melody_program)
+    elif engine != 'music21':
+        raise ValueError(f"Unknown MIDI engine '{engine}'. Use 'music21' or 'raw'.")
+
+    music21 = _import_music21()
+    midi, chord = music21.midi, music21.chord
+
     # Load MIDI file
     mf = midi.MidiFile()
     mf.open(midi_name)
@@ -95,6 +143,173 @@ def get_midi(midi_name, melody_program=0):
 
     return melody
 
+
+# Lightweight note used by the 'raw' engine: MIDI pitch, onset in quarter notes, and whether
+# the onset held several notes (a chord in music21 terms) of which only the top one was kept.
+RawNote = namedtuple('RawNote', ['pitch', 'offset', 'is_chord'])
+
+
+def _read_varlen(data, pos):
+    """
+    Reads a MIDI variable-length quantity.
+
+    Returns:
+    - tuple: The decoded value and the position after it.
+    """
+    value = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value = (value << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            return value, pos
+
+
+def _parse_midi_file(midi_name):
+    """
+    Parses a Standard MIDI File into note events, without building any music21 objects.
+
+    Parameters:
+    - midi_name (str): Path to the MIDI file.
+
+    Returns:
+    - tuple: Ticks per quarter note and a list of tracks that contain note-ons. Each track is a list of
+      (tick, is_note_on, channel, pitch) tuples in file order.
+    """
+    with open(midi_name, 'rb') as handle:
+        data = handle.read()
+
+    if data[:4] != b'MThd':
+        raise ValueError(f'{midi_name} is not a Standard MIDI File.')
+    header_len = int.from_bytes(data[4:8], 'big')
+    division = int.from_bytes(data[12:14], 'big')
+    if division & 0x8000:
+        raise ValueError('SMPTE time division is not supported by the raw engine.')
+
+    tracks = []
+    pos = 8 + header_len
+    while pos + 8 <= len(data):
+        chunk_type = data[pos:pos + 4]
+        chunk_len = int.from_bytes(data[pos + 4:pos + 8], 'big')
+        pos += 8
+        end = min(pos + chunk_len, len(data))
+        if chunk_type != b'MTrk':
+            pos = end
+            continue
+
+        events = []
+        has_notes = False
+        tick = 0
+        status = 0
+        while pos < end:
+            delta, pos = _read_varlen(data, pos)
+            tick += delta
+            byte = data[pos]
+            if byte & 0x80:
+                pos += 1
+                if byte == 0xFF:  # meta event
+                    length, pos = _read_varlen(data, pos + 1)
+                    pos += length
+                    continue
+                if byte in (0xF0, 0xF7):  # sysex
+                    length, pos = _read_varlen(data, pos)
+                    pos += length
+                    continue
+                status = byte
+            # otherwise running status: reuse the previous channel status byte
+            kind = status & 0xF0
+            if kind in (0xC0, 0xD0):
+                pos += 1
+                continue
+            if kind in (0x80, 0x90):
+                pitch, velocity = data[pos], data[pos + 1]
+                is_note_on = kind == 0x90 and velocity > 0
+                has_notes = has_notes or is_note_on
+                events.append((tick, is_note_on, status & 0x0F, pitch))
+            pos += 2
+        pos = end
+
+        # Like music21, only tracks with note-ons become parts
+        if has_notes:
+            tracks.append(events)
+
+    return division, tracks
+
+
+def _quantize_offset(value, divisors=(4, 3)):
+    """
+    Quantizes an offset in quarter notes to the closest grid among `divisors`, following music21's
+    default post-quantization (ties go to the lower multiple and to the finer grid).
+    """
+    best = None
+    for div in divisors:
+        unit = 1 / div
+        low = unit * math.floor(value / unit)
+        if value <= low + unit / 2.0:
+            match, error = low, round(value - low, 7)
+        else:
+            match, error = low + unit, round(low + unit - value, 7)
+        if best is None or (error, unit) < best[:2]:
+            best = (error, unit, match)
+    return best[2]
+
+
+def get_midi_raw(midi_name, melody_program=0):
+    """
+    Extracts the melody from a MIDI file by reading note events directly from the track bytes.
+
+    This produces the same pitches and onsets as `get_midi()` (onsets quantized to quarter-note units,
+    tied notes merged, top note taken for chords) without building a music21 stream, which makes it much
+    faster for large corpora. As in music21, only simultaneous notes that also end together form a chord;
+    simultaneous notes that end at different times are all kept, in file order. One known difference remains:
+    music21 may split and shift overlapping notes that cross a barline, which the raw engine does not do.
+
+    Parameters:
+    - midi_name (str): Path to the MIDI file.
+    - melody_program (int, optional): The instrument index to extract. Defaults to 0.
+
+    Returns:
+    - list: The extracted melody notes (RawNote tuples).
+    """
+    ticks_per_quarter, tracks = _parse_midi_file(midi_name)
+    events = tracks[melody_program]
+
+    # Pair each note-on with the first following note-off of the same pitch and channel
+    notes = []
+    pending = {}
+    for tick, is_note_on, channel, pitch in events:
+        if is_note_on:
+            note_on = [tick, None, channel, pitch]
+            notes.append(note_on)
+            pending.setdefault((channel, pitch), deque()).append(note_on)
+        elif pending.get((channel, pitch)):
+            pending[(channel, pitch)].popleft()[1] = tick
+    notes = [nt for nt in notes if nt[1] is not None and nt[2] != 9]  # skip unmatched and percussion
+
+    # Gather notes starting (and ending) within the quantization tolerance into chords, as music21 does.
+    # Simultaneous notes that end at different times are not chords: music21 puts them in separate voices,
+    # so they are all kept, in file order.
+    tolerance = ticks_per_quarter / 4
+    melody = []
+    gathered = set()
+    for i, (on, off, _, pitch) in enumerate(notes):
+        if i in gathered:
+            continue
+        top, is_chord = pitch, False
+        for j in range(i + 1, len(notes)):
+            on_sub, off_sub, _, pitch_sub = notes[j]
+            if abs(on_sub - on) >= tolerance:
+                break
+            if abs(off_sub - off) > tolerance:
+                continue
+            gathered.add(j)
+            top, is_chord = max(top, pitch_sub), True
+
+        melody.append(RawNote(top, _quantize_offset(on / ticks_per_quarter), is_chord))
+
+    melody.sort(key=lambda nt: nt.offset)  # stable, so simultaneous notes keep their file order
+    return melody
+
 def get_pitch_interval(melody):
     """
     Calculates pitch intervals from a given melody using music21.
@@ -107,16 +322,25 @@ def get_pitch_interval(melody):
     """
     pitches = []
     found_chords = False  # Track chord objects presence
+    Chord = None
 
     for nt in melody:
-        if isinstance(nt, chord.Chord):
+        if isinstance(nt, RawNote):
+            pitches.append(nt.pitch)
+            found_chords = found_chords or nt.is_chord
+            continue
+
+        if Chord is None:
+            Chord = _import_music21().chord.Chord
+
+        if isinstance(nt, Chord):
             pitches.append(nt.sortAscending().pitches[-1].midi)
             found_chords = True
         elif hasattr(nt, 'pitch'):
             pitches.append(nt.pitch.midi)
 
     pitch_interval = np.diff(pitches)
-    pitchi = np.clip(pitch_interval, -12, 12)
+    pitchi = np.clip(pitch_interval, *PITCH_INTERVAL_RANGE)
 
     if found_chords:
         print("Warning: Chord objects detected in music21. Only top notes of chords extracted - chords may indicate polyphony but can also be in monophonic compositions.")
@@ -141,12 +365,167 @@ def get_IOI(melody, notequantize=0.25):
     if notequantize is not None and beat_interval.size > 0:
         beat_interval = notequantize * np.round(beat_interval / notequantize)
 
-    beati = np.clip(beat_interval, 0, 4)
+    beati = np.clip(beat_interval, *IOI_RANGE)
 
     return beati, notequantize
 
 
 # Function to convert pitch and IOI to Mel2Word representation
+def get_M2W_features(melody, notequantize=0.25):
+    """
+    Converts pitch and IOIs of a melody to all Mel2Word representations at once.
+
+    The pitch intervals and IOIs are computed a single time and shared by the pitch, rhythm and
+    combined sequences.
+
+    Parameters:
+    - melody (list): The melody notes (music21 notes or RawNote tuples).
+    - notequantize (float, optional): The quantization value for note intervals. Defaults to 0.25.
+
+    Returns:
+    - dict: The Mel2Word representations keyed by feature ('pitch', 'rhythm' and 'all').
+    """
+    pmidi = get_pitch_interval(melody)
+    rtext, quant = get_IOI(melody, notequantize)
+    ptext = [f"U{int(com):02d}" if com > 0 else (f"D{int(-com):02d}" if com < 0 else 'E00') for com in pmidi]
+
+    if quant == 0.25:
+        rtext = [f'{int(com * 100):03d}' for com in rtext if com >= 0.25]
+    elif quant == 0.125:
+        rtext = [f'{int(com * 1000):04d}' for com in rtext]
+    else:
+        rtext = [f'{int(com * 10000):05d}' for com in rtext]
+
+    alltext = [pt + rt for pt, rt in zip(ptext, rtext)]
+
+    return {'pitch': ptext, 'rhythm': rtext, 'all': alltext}
+
+
+def get_note_arrays(melodies):
+    """
+    Concatenates the pitches and onsets of several melodies into flat arrays for `get_M2W_features_batch()`.
+
+    Parameters:
+    - melodies (list): The melodies (lists of music21 notes or RawNote tuples, as returned by `get_midi()`).
+
+    Returns:
+    - tuple: The pitches (int array), the onsets in quarter notes (float array) and the offsets of each melody in
+      them (melody i is `pitches[offsets[i]:offsets[i + 1]]`).
+    """
+    pitches = []
+    onsets = []
+    offsets = [0]
+    chord_melodies = 0
+    Chord = None
+
+    for melody in melodies:
+        found_chords = False
+        for nt in melody:
+            if isinstance(nt, RawNote):
+                pitches.append(nt.pitch)
+                found_chords = found_chords or nt.is_chord
+            else:
+                if Chord is None:
+                    Chord = _import_music21().chord.Chord
+                if isinstance(nt, Chord):
+                    pitches.append(nt.sortAscending().pitches[-1].midi)
+                    found_chords = True
+                elif hasattr(nt, 'pitch'):
+                    pitches.append(nt.pitch.midi)
+                else:
+                    continue
+            onsets.append(float(nt.offset))
+        offsets.append(len(pitches))
+        chord_melodies += found_chords
+
+    if chord_melodies:
+        print(f"Warning: Chord objects detected in {chord_melodies} melodies. Only top notes of chords extracted - chords may indicate polyphony but can also be in monophonic compositions.")
+
+    return np.array(pitches, dtype=np.int64), np.array(onsets, dtype=float), np.array(offsets, dtype=np.int64)
+
+
+def _ragged_positions(starts, lengths):
+    # Flat indices of [starts[i], starts[i] + lengths[i]) for every i, without a Python loop
+    lengths = np.asarray(lengths, dtype=np.int64)
+    ends = np.cumsum(lengths)
+    return np.arange(ends[-1] if len(ends) else 0) - np.repeat(ends - lengths - starts, lengths)
+
+
+def _encode_symbols(codes, fmt):
+    # Formats each distinct code once and looks the symbols up, instead of formatting every element
+    uniq, inverse = np.unique(codes, return_inverse=True)
+    table = np.array([fmt(code) for code in uniq.tolist()] or [''], dtype=object)
+    return table[inverse.reshape(-1)], inverse.reshape(-1), table
+
+
+def get_M2W_features_batch(pitches, onsets, offsets, notequantize=0.25):
+    """
+    Converts a batch of melodies to Mel2Word representations with NumPy, over ragged note arrays.
+
+    The pitch intervals and IOIs of the whole batch are computed with single array operations (differences
+    across melody boundaries are dropped), clipped and quantized like `get_pitch_interval()` and `get_IOI()`,
+    and the M2W symbols are looked up from tables of the distinct values rather than formatted one element at
+    a time. The result for each melody is the same as `get_M2W_features()`.
+
+    Parameters:
+    - pitches (array): MIDI pitches of all melodies, concatenated (see `get_note_arrays()`).
+    - onsets (array): Onsets in quarter notes of all melodies, concatenated.
+    - offsets (array): Start of each melody in the note arrays, followed by the total number of notes.
+    - notequantize (float, optional): The quantization value for note intervals. Defaults to 0.25.
+
+    Returns:
+    - list: The Mel2Word representations of each melody, as dicts keyed by feature ('pitch', 'rhythm' and 'all').
+    """
+    pitches = np.asarray(pitches, dtype=np.int64)
+    onsets = np.asarray(onsets, dtype=float)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    n_melodies = len(offsets) - 1
+
+    # Intervals within each melody: a melody of n notes has max(n - 1, 0) of them
+    note_counts = np.diff(offsets)
+    melody_of_note = np.repeat(np.arange(n_melodies), note_counts)
+    within = melody_of_note[1:] == melody_of_note[:-1]
+    interval_counts = np.maximum(note_counts - 1, 0)
+
+    pitch_interval = np.clip(np.diff(pitches)[within], *PITCH_INTERVAL_RANGE)
+    beat_interval = np.diff(onsets)[within]
+    if notequantize is not None and beat_interval.size > 0:
+        beat_interval = notequantize * np.round(beat_interval / notequantize)
+    beat_interval = np.clip(beat_interval, *IOI_RANGE)
+
+    ptext, pcodes, ptable = _encode_symbols(pitch_interval, lambda com: f"U{com:02d}" if com > 0 else (f"D{-com:02d}" if com < 0 else 'E00'))
+
+    rhythm_counts = interval_counts
+    if notequantize == 0.25:
+        keep = beat_interval >= 0.25
+        beat_interval = beat_interval[keep]
+        rhythm_counts = np.bincount(melody_of_note[1:][within][keep], minlength=n_melodies) if n_melodies else interval_counts
+        rcodes, width = (beat_interval * 100).astype(np.int64), 3
+    elif notequantize == 0.125:
+        rcodes, width = (beat_interval * 1000).astype(np.int64), 4
+    else:
+        rcodes, width = (beat_interval * 10000).astype(np.int64), 5
+    rtext, rcodes, rtable = _encode_symbols(rcodes, lambda com: f'{com:0{width}d}')
+
+    # The combined symbols pair the i-th pitch and rhythm symbols of a melody, as zip() does
+    pitch_starts = np.concatenate(([0], np.cumsum(interval_counts)[:-1])) if n_melodies else interval_counts
+    rhythm_starts = np.concatenate(([0], np.cumsum(rhythm_counts)[:-1])) if n_melodies else rhythm_counts
+    all_counts = np.minimum(interval_counts, rhythm_counts)
+    pair_codes = (pcodes[_ragged_positions(pitch_starts, all_counts)] * len(rtable)
+                  + rcodes[_ragged_positions(rhythm_starts, all_counts)])
+    alltext, _, _ = _encode_symbols(pair_codes, lambda code: ptable[code // len(rtable)] + rtable[code % len(rtable)])
+
+    features = [{} for _ in range(n_melodies)]
+    for feat, text, counts in (('pitch', ptext, interval_counts), ('rhythm', rtext, rhythm_counts), ('all', alltext, all_counts)):
+        text = text.tolist()
+        start = 0
+        for feature, stop in zip(features, np.cumsum(counts).tolist()):
+            feature[feat] = text[start:stop]
+            start = stop
+
+    return features
+
+
 def get_M2W(melody, feat='all'):
     """
     Converts pitch and IOIs of a melody to Mel2Word representation.
@@ -159,66 +538,182 @@ def get_M2W(melody, feat='all'):
     - list: The Mel2Word representation.
     """
     try:
-      pmidi = get_pitch_interval(melody)
-      rtext, quant = get_IOI(melody)
-      ptext = [f"U{int(com):02d}" if com > 0 else (f"D{int(-com):02d}" if com < 0 else 'E00') for com in pmidi]
-
-      if quant == 0.25:
-          rtext = [f'{int(com * 100):03d}' for com in rtext if com >= 0.25]
-      elif quant == 0.125:
-          rtext = [f'{int(com * 1000):04d}' for com in rtext]
-      else:
-          rtext = [f'{int(com * 10000):05d}' for com in rtext]
-
-      alltext = [pt + rt for pt, rt in zip(ptext, rtext)]
-
-      if feat == 'pitch':
-          return ptext
-      elif feat == 'rhythm':
-          return rtext
-      elif feat == 'all':
-          return alltext
+      return get_M2W_features(melody).get(feat)
     except:
       print("ERROR!!:Verify if the file is a valid monophonic MIDI file.")
 
 
-def get_M2W_from_midipath(midipath, feature_option=3):
+def get_M2W_from_midipath(midipath, feature_option=3, engine='music21'):
     """
     Converts a MIDI file to Mel2Word representation based on specified feature options.
 
     Parameters:
     - midipath (str): The path of the MIDI file.
     - feature_option (int, optional): Option for the feature type to convert (1 for 'pitch', 2 for 'rhythm', 3 for 'all'). Defaults to 3.
+    - engine (str, optional): MIDI extraction engine ('music21' or 'raw'). Defaults to 'music21'.
 
     Returns:
     - list: The Mel2Word representation of the MIDI file.
     """
-    melody = get_midi(midipath)
+    melody = get_midi(midipath, engine=engine)
 
-    if feature_option == 1:
-        m2w_representation = get_M2W(melody, feat='pitch')
-    elif feature_option == 2:
-        m2w_representation = get_M2W(melody, feat='rhythm')
-    elif feature_option == 3:
-        m2w_representation = get_M2W(melody, feat='all')
-    else:
+    feat_mapping = {1: 'pitch', 2: 'rhythm', 3: 'all'}
+    if feature_option not in feat_mapping:
         print("Invalid feature option. Defaulting to both features.")
-        m2w_representation = get_M2W(melody, feat='all')
+
+    m2w_representation = get_M2W(melody, feat=feat_mapping.get(feature_option, 'all'))
 
     return m2w_representation
 
 
 
-def get_M2W_dataset(midi_path, log_freq=100):
+class M2WCache:
+    """
+    On-disk cache of per-file Mel2Word results, keyed by the MIDI file content and the conversion parameters.
+
+    Each entry stores the pitch, rhythm and combined M2W sequences of one file, so unchanged files are not parsed
+    again by `get_M2W_dataset()`. When the cache grows beyond `max_size` bytes, the least recently used entries are
+    evicted, every `evict_every` writes and at the end of each pass over a dataset.
+
+    Parameters:
+    - cache_dir (str): The directory holding the cache entries (created if needed).
+    - max_size (int, optional): The maximum total size of the entries in bytes. Defaults to 512 MB.
+    - evict_every (int, optional): The number of writes between two evictions. Defaults to 256.
+    """
+
+    # Part of every entry key. Bump it whenever the output of get_midi_raw(), get_midi() or get_M2W_features()
+    # changes, so entries written by older code are not served.
+    # 2: the raw engine keeps simultaneous notes that are not chords.
+    VERSION = 2
+
+    def __init__(self, cache_dir, max_size=512 * 1024 ** 2, evict_every=256):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.evict_every = evict_every
+        self._writes = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def content_hash(midi_file_path):
+        with open(midi_file_path, 'rb') as handle:
+            return hashlib.sha256(handle.read()).hexdigest()
+
+    @staticmethod
+    def params_hash(params):
+        return hashlib.sha256(repr(sorted(params.items())).encode()).hexdigest()[:16]
+
+    def _entry_path(self, content_hash, params):
+        return join(self.cache_dir, f'{content_hash}_{self.params_hash(params)}.pkl')
+
+    def get(self, content_hash, params):
+        """
+        Returns the cached M2W features of a file content for the given parameters, or None.
+        """
+        entry_path = self._entry_path(content_hash, params)
+        try:
+            with open(entry_path, 'rb') as handle:
+                features = pickle.load(handle)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+        os.utime(entry_path)  # mark as recently used
+        return features
+
+    def put(self, content_hash, params, features):
+        """
+        Stores the M2W features of a file content for the given parameters.
+        """
+        entry_path = self._entry_path(content_hash, params)
+        tmp_path = f'{entry_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as handle:
+            pickle.dump(features, handle, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, entry_path)
+
+        # Keep the cache bounded during long streaming passes
+        self._writes += 1
+        if self._writes % self.evict_every == 0:
+            self.evict()
+
+    def _entries(self):
+        return [join(self.cache_dir, f) for f in listdir(self.cache_dir) if f.endswith('.pkl')]
+
+    def size(self):
+        """
+        Returns the total size of the cache entries in bytes.
+        """
+        return sum(os.path.getsize(entry_path) for entry_path in self._entries())
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the cache fits in `max_size`.
+
+        Returns:
+        - int: The number of removed entries.
+        """
+        entries = sorted((os.stat(entry_path).st_mtime, os.path.getsize(entry_path), entry_path) for entry_path in self._entries())
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, entry_path in entries:
+            if total <= self.max_size:
+                break
+            os.remove(entry_path)
+            total -= size
+            removed += 1
+        return removed
+
+    def invalidate(self, midi_file_path=None):
+        """
+        Removes the cached results of a MIDI file (for all parameters), or every entry if no file is given.
+
+        Returns:
+        - int: The number of removed entries.
+        """
+        prefix = '' if midi_file_path is None else self.content_hash(midi_file_path) + '_'
+        removed = 0
+        for f in listdir(self.cache_dir):
+            if f.startswith(prefix) and f.endswith('.pkl'):
+                os.remove(join(self.cache_dir, f))
+                removed += 1
+        return removed
+
+
+def _cache_params(engine, melody_program, notequantize):
+    # The conversion parameters that key a cache entry (shared by the batch and streaming paths)
+    return {'version': M2WCache.VERSION, 'engine': engine, 'melody_program': melody_program,
+            'notequantize': notequantize, 'pitch_range': PITCH_INTERVAL_RANGE, 'ioi_range': IOI_RANGE}
+
+
+def _convert_midi_file(midi_path, midi_name, engine='music21', melody_program=0, notequantize=0.25):
+    """
+    Converts a single MIDI file of a dataset folder to its Mel2Word features.
+
+    Returns:
+    - tuple: The Mel2Word features (None on failure) and the error (None on success).
+    """
+    try:
+        melody = get_midi(join(midi_path, midi_name), melody_program, engine=engine)
+        return get_M2W_features(melody, notequantize), None
+    except Exception as e:
+        return None, e
+
+
+def get_M2W_dataset(midi_path, log_freq=100, engine='music21', n_jobs=1, chunksize=16, cache=None,
+                    melody_program=0, notequantize=0.25):
     """
     Generates a Mel2Word dataset from MIDI files in a specified directory.
 
     Parameters:
     - midi_path (str): The directory path containing MIDI files.
     - log_freq (int): Progress print interval.
+    - engine (str, optional): MIDI extraction engine ('music21' or 'raw'). Defaults to 'music21'.
+    - n_jobs (int, optional): Number of worker processes; 1 converts serially, None uses all CPU cores. Defaults to 1.
+    - chunksize (int, optional): Number of files sent to a worker at a time when n_jobs > 1. Defaults to 16.
+    - cache (M2WCache or str, optional): A cache (or cache directory) of per-file results; unchanged files are not
+      converted again. Defaults to None (no cache).
+    - melody_program (int, optional): The instrument index to extract. Defaults to 0.
+    - notequantize (float, optional): The quantization value for note intervals. Defaults to 0.25.
     
     Returns:
-    - list: A list of dictionaries, each containing Mel2Word data for a MIDI file.
+    - list: A list of dictionaries, each containing Mel2Word data for a MIDI file (sorted by file name).
     """
 
     print('Preparing...')
@@ -226,26 +721,503 @@ def get_M2W_dataset(midi_path, log_freq=100):
     M2W_dataset = []
     error_midi_files = []
 
-    for idx, midi_name in enumerate(onlyfiles):
-        midi_file_path = join(midi_path, midi_name)
-        try:
-            melody = get_midi(midi_file_path)
-            midi = {'f_name': midi_name, 
-                    'M2W_pitch': get_M2W(melody, feat='pitch'),
-                    'M2W_rhythm': get_M2W(melody, feat='rhythm'),
-                    'M2W_all': get_M2W(melody, feat='all')}
-            M2W_dataset.append(midi)
-
-            if (idx + 1) % log_freq == 0:
-                print(f"{idx + 1} of {len(onlyfiles)} files processed..")
-        except Exception as e:
-            print(f'ERROR ON {midi_name}: {e}..skipping the file..')
-            error_midi_files.append(midi_name)
+    if isinstance(cache, str):
+        cache = M2WCache(cache)
+
+    # Look up unchanged files in the cache; only the others are converted
+    cached = {}
+    content_hashes = {}
+    params = _cache_params(engine, melody_program, notequantize)
+    if cache is not None:
+        for midi_name in onlyfiles:
+            content_hashes[midi_name] = cache.content_hash(join(midi_path, midi_name))
+            features = cache.get(content_hashes[midi_name], params)
+            if features is not None:
+                cached[midi_name] = features
+    todo = [f for f in onlyfiles if f not in cached]
+
+    convert = partial(_convert_midi_file, midi_path, engine=engine, melody_program=melody_program, notequantize=notequantize)
+
+    if n_jobs == 1:
+        results = map(convert, todo)
+        executor = None
+    else:
+        executor = ProcessPoolExecutor(max_workers=n_jobs)
+        # map() yields results in input order, so the output stays sorted by file name
+        results = executor.map(convert, todo, chunksize=chunksize)
+
+    try:
+        for idx, midi_name in enumerate(onlyfiles):
+            if midi_name in cached:
+                features, error = cached[midi_name], None
+            else:
+                features, error = next(results)
+                if cache is not None and error is None:
+                    cache.put(content_hashes[midi_name], params, features)
+
+            if error is None:
+                midi = {'f_name': midi_name, 
+                        'M2W_pitch': features['pitch'],
+                        'M2W_rhythm': features['rhythm'],
+                        'M2W_all': features['all']}
+                M2W_dataset.append(midi)
+
+                if (idx + 1) % log_freq == 0:
+                    print(f"{idx + 1} of {len(onlyfiles)} files processed..")
+            else:
+                print(f'ERROR ON {midi_name}: {error}..skipping the file..')
+                error_midi_files.append(midi_name)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    if cache is not None:
+        cache.evict()
+        print(f'{len(cached)} of {len(onlyfiles)} files loaded from the cache.')
 
     print(f'Done. Processed {len(M2W_dataset)} files with {len(error_midi_files)} errors.')
     return M2W_dataset 
 
 
+def iter_M2W_dataset(midi_path, engine='music21', cache=None, melody_program=0, notequantize=0.25, log_freq=None):
+    """
+    Lazily generates the Mel2Word data of the MIDI files in a directory, one file at a time.
+
+    This is the streaming variant of `get_M2W_dataset()`: the melodies are converted as they are consumed,
+    so the whole dataset is never held in memory. Files that cannot be converted are reported and skipped.
+
+    Parameters:
+    - midi_path (str): The directory path containing MIDI files.
+    - engine (str, optional): MIDI extraction engine ('music21' or 'raw'). Defaults to 'music21'.
+    - cache (M2WCache or str, optional): A cache (or cache directory) of per-file results. Defaults to None.
+    - melody_program (int, optional): The instrument index to extract. Defaults to 0.
+    - notequantize (float, optional): The quantization value for note intervals. Defaults to 0.25.
+    - log_freq (int, optional): Progress print interval. Defaults to None (no progress prints).
+
+    Yields:
+    - dict: The Mel2Word data of a MIDI file (in file name order).
+    """
+    onlyfiles = sorted([f for f in listdir(midi_path) if isfile(join(midi_path, f))])
+
+    if isinstance(cache, str):
+        cache = M2WCache(cache)
+    params = _cache_params(engine, melody_program, notequantize)
+
+    try:
+        for idx, midi_name in enumerate(onlyfiles):
+            features = None
+            if cache is not None:
+                content_hash = cache.content_hash(join(midi_path, midi_name))
+                features = cache.get(content_hash, params)
+
+            if features is None:
+                features, error = _convert_midi_file(midi_path, midi_name, engine, melody_program, notequantize)
+                if error is not None:
+                    print(f'ERROR ON {midi_name}: {error}..skipping the file..')
+                    continue
+                if cache is not None:
+                    cache.put(content_hash, params, features)
+
+            if log_freq and (idx + 1) % log_freq == 0:
+                print(f"{idx + 1} of {len(onlyfiles)} files processed..")
+
+            yield {'f_name': midi_name, 
+                   'M2W_pitch': features['pitch'],
+                   'M2W_rhythm': features['rhythm'],
+                   'M2W_all': features['all']}
+    finally:
+        # Also runs when the consumer stops early and the generator is closed
+        if cache is not None:
+            cache.evict()
+
+
+class M2WCorpus:
+    """
+    A re-iterable Mel2Word corpus over a directory of MIDI files.
+
+    Every iteration converts the files again with `iter_M2W_dataset()`, so consumers that make several passes
+    (token counting, tokenization, Word2Vec training) can stream the corpus without materialising it.
+    Passing a `cache` makes the later passes cheap.
+
+    Parameters:
+    - midi_path (str): The directory path containing MIDI files.
+    - **kwargs: Options of `iter_M2W_dataset()` (engine, cache, melody_program, notequantize, log_freq).
+    """
+
+    def __init__(self, midi_path, **kwargs):
+        self.midi_path = midi_path
+        self.kwargs = kwargs
+        if isinstance(kwargs.get('cache'), str):
+            self.kwargs['cache'] = M2WCache(kwargs['cache'])
+
+    def __iter__(self):
+        return iter_M2W_dataset(self.midi_path, **self.kwargs)
+
+    def feature(self, feat):
+        """
+        Returns a re-iterable view of one feature ('M2W_pitch', 'token_all', ...) of the corpus.
+        """
+        return M2WFeatureView(self, feat)
+
+
+class M2WFeatureView:
+    """
+    A re-iterable view of one feature of a dataset (a list of dicts, an M2WCorpus or any re-iterable of dicts),
+    yielding the sequence of each song without copying them into a new list. The dataset can also be a function
+    returning a new iterator of dicts (e.g. a generator function), which is called on every pass.
+
+    A one-shot iterator (e.g. a generator object) can only be streamed once; a second pass raises a TypeError
+    instead of silently yielding nothing.
+    """
+
+    def __init__(self, data, feat):
+        self.data = data
+        self.feat = feat
+        self._one_shot = _is_one_shot_iterator(data)
+        self._consumed = False
+
+    def __iter__(self):
+        if isinstance(self.data, M2WColumnarDataset):
+            # Only decode the one column
+            yield from self.data.feature(self.feat)
+            return
+        if self._one_shot:
+            if self._consumed:
+                raise TypeError('The dataset is a one-shot iterator and has already been consumed. '
+                                'Pass a list or a function returning a new iterator (e.g. a generator function).')
+            self._consumed = True
+        for song in (self.data() if callable(self.data) else self.data):
+            yield song[self.feat]
+
+
+def _is_one_shot_iterator(data):
+    """
+    Returns True if `data` is an iterator that can only be iterated once (e.g. a generator object),
+    as opposed to a re-iterable dataset or a function returning a new iterator.
+    """
+    return not callable(data) and iter(data) is data
+
+
+def load_dataset(path):
+    """
+    Load a Mel2Word dataset from a given file path.
+
+    Parameters:
+    - path (str): The file path to the dataset (a pickle such as 'Tokenized_ANN_Example.pkl', or a columnar
+      dataset saved by `save_dataset()`).
+
+    Returns:
+    - list or M2WColumnarDataset: The loaded dataset. Columnar datasets are memory-mapped read-only.
+    """
+    with open(path, 'rb') as handle:
+        if handle.read(len(M2WColumnarDataset.MAGIC)) == M2WColumnarDataset.MAGIC:
+            return M2WColumnarDataset.load(path)
+        handle.seek(0)
+        return pickle.load(handle)
+
+
+def save_dataset(data, path):
+    """
+    Save a Mel2Word dataset (a list of dicts, as returned by `get_M2W_dataset()`) in the columnar format.
+
+    Parameters:
+    - data (list of dicts): The dataset to save.
+    - path (str): The output file path (e.g. 'Tokenized_ANN_Example.m2wc').
+    """
+    with open(path, 'wb') as handle:
+        handle.write(M2WColumnarDataset.encode(data))
+
+
+def convert_dataset(pkl_path, path):
+    """
+    Convert a pickled dataset (such as 'Tokenized_ANN_Example.pkl') to the columnar format.
+
+    Parameters:
+    - pkl_path (str): The pickled dataset.
+    - path (str): The output file path.
+    """
+    with open(pkl_path, 'rb') as handle:
+        save_dataset(pickle.load(handle), path)
+
+
+class M2WColumnarDataset(Sequence):
+    """
+    A read-only Mel2Word dataset stored column by column.
+
+    Every feature ('M2W_pitch', 'M2W_rhythm', 'M2W_all', 'token_*', ...) is stored as one array of integer IDs
+    with per-melody offsets, and all features share one vocabulary of unit and token strings; string fields such
+    as 'f_name' are stored as one ID per melody. The file is memory-mapped, so loading it reads nothing but a
+    small manifest, and a column or a melody is only decoded when it is accessed. Indexing gives the same dicts
+    as the pickled datasets, so the dataset can be passed to the functions that read lists of dicts.
+
+    Parameters:
+    - buffer (bytes or mmap): The encoded dataset.
+    - path (str, optional): The file the buffer is mapped from.
+    """
+
+    MAGIC = b'M2WC'
+    VERSION = 1
+    _HEADER = struct.Struct('<4sIQ')  # magic, version, manifest size
+
+    def __init__(self, buffer, path=None):
+        self._buffer = buffer
+        self.path = path
+        magic, version, manifest_size = self._HEADER.unpack_from(buffer, 0)
+        if magic != self.MAGIC or version != self.VERSION:
+            raise ValueError('Not a columnar M2W dataset (or an unsupported version).')
+
+        manifest = json.loads(bytes(buffer[self._HEADER.size:self._HEADER.size + manifest_size]).decode('utf-8'))
+        self.columns = manifest['columns']  # column name -> 'list' or 'str'
+        self._n_melodies = manifest['melodies']
+        self._sections = manifest['sections']  # section name -> (dtype, offset from the data start, count)
+        self._data_start = self._align(self._HEADER.size + manifest_size)
+        self._arrays = {}
+        self._vocab = None
+
+    @staticmethod
+    def _align(pos):
+        return pos + -pos % 8
+
+    @classmethod
+    def encode(cls, data):
+        """
+        Encodes a dataset (a list of dicts with the same keys) to the columnar binary format.
+        """
+        columns = {name: 'str' if isinstance(value, str) else 'list' for name, value in data[0].items()} if data else {}
+        vocab = {}
+        arrays = {}
+        for name, kind in columns.items():
+            try:
+                values = [midi[name] for midi in data]
+            except KeyError:
+                raise ValueError(f"Every melody of the dataset needs the '{name}' field.")
+            if kind == 'str':
+                ids = [vocab.setdefault(value, len(vocab)) for value in values]
+                offsets = np.arange(len(values) + 1)
+            else:
+                ids = [vocab.setdefault(unit, len(vocab)) for value in values for unit in value]
+                offsets = np.cumsum([0] + [len(value) for value in values])
+            arrays[name + '.ids'] = np.array(ids, dtype='<u4')
+            arrays[name + '.offsets'] = np.asarray(offsets, dtype='<i8')
+
+        encoded_vocab = [token.encode('utf-8') for token in vocab]
+        arrays['vocab.offsets'] = np.cumsum([0] + [len(token) for token in encoded_vocab]).astype('<i8')
+        arrays['vocab.blob'] = np.frombuffer(b''.join(encoded_vocab), dtype='u1')
+
+        sections = {}
+        body = bytearray()
+        for name, array_ in arrays.items():
+            body += bytes(-len(body) % 8)
+            sections[name] = (array_.dtype.str, len(body), int(array_.size))
+            body += array_.tobytes()
+
+        manifest = json.dumps({'columns': columns, 'melodies': len(data), 'sections': sections}).encode('utf-8')
+        out = bytearray(cls._HEADER.pack(cls.MAGIC, cls.VERSION, len(manifest)))
+        out += manifest
+        out += bytes(cls._align(len(out)) - len(out))
+        out += body
+        return bytes(out)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Memory-maps a columnar dataset file read-only.
+        """
+        with open(path, 'rb') as handle:
+            buffer = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(buffer, path)
+
+    @classmethod
+    def from_list(cls, data):
+        return cls(cls.encode(data))
+
+    def __reduce__(self):
+        # Worker processes map the same file instead of receiving a copy
+        if self.path is not None:
+            return (M2WColumnarDataset.load, (self.path,))
+        return (M2WColumnarDataset, (bytes(self._buffer),))
+
+    def _array(self, name):
+        array_ = self._arrays.get(name)
+        if array_ is None:
+            dtype, offset, count = self._sections[name]
+            array_ = self._arrays[name] = np.frombuffer(self._buffer, dtype=dtype, count=count,
+                                                        offset=self._data_start + offset)
+        return array_
+
+    @property
+    def vocab(self):
+        """
+        The shared vocabulary (ID -> string), decoded on first use.
+        """
+        if self._vocab is None:
+            blob = self._array('vocab.blob').tobytes()
+            offsets = self._array('vocab.offsets').tolist()
+            self._vocab = [blob[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(len(offsets) - 1)]
+        return self._vocab
+
+    def ids(self, column, idx):
+        """
+        Returns the ID array of one melody in a column (a zero-copy view of the file).
+        """
+        offsets = self._array(column + '.offsets')
+        return self._array(column + '.ids')[offsets[idx]:offsets[idx + 1]]
+
+    def value(self, column, idx):
+        """
+        Returns the decoded value of one melody in a column: a list of strings, or a string for string fields.
+        """
+        vocab = self.vocab
+        if self.columns[column] == 'str':
+            return vocab[self.ids(column, idx)[0]]
+        return [vocab[token_id] for token_id in self.ids(column, idx).tolist()]
+
+    def feature(self, feat):
+        """
+        Returns a lazy, re-iterable view of one column ('M2W_pitch', 'token_all', ...) of the dataset.
+        """
+        return M2WColumn(self, feat)
+
+    def __len__(self):
+        return self._n_melodies
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError('M2WColumnarDataset index out of range')
+        return {column: self.value(column, idx) for column in self.columns}
+
+
+class M2WColumn(Sequence):
+    """
+    One column of an M2WColumnarDataset, decoding the value of a melody only when it is accessed.
+    """
+
+    def __init__(self, dataset, column):
+        if column not in dataset.columns:
+            raise KeyError(column)
+        self.dataset = dataset
+        self.column = column
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError('M2WColumn index out of range')
+        return self.dataset.value(self.column, idx)
+
+
+# Synthetic polyphonic melodies for `check_midi_engine_parity()`, as (onset, duration, pitch) in quarter notes.
+# They cover onsets shared by notes that end together (a chord) and by notes that end apart (separate voices).
+PARITY_CASES = {
+    'synthetic_chord': [(0, 1, 60), (0, 1, 64), (1, 1, 67), (2, 1, 69)],
+    'synthetic_voices': [(0, 2, 60), (0, 1, 64), (1, 1, 67), (2, 1, 69)],
+    'synthetic_voices_short_first': [(0, 1, 64), (0, 2, 60), (1, 1, 67), (2, 1, 69)],
+    'synthetic_chord_and_voice': [(0, 1, 60), (0, 1, 64), (0, 2, 55), (1, 1, 67)],
+    'synthetic_near_onsets': [(0, 1, 60), (0.05, 2, 64), (1, 1, 67)],
+}
+
+
+def _write_note_events(notes, ticks_per_quarter=480):
+    """
+    Writes (onset, duration, pitch) notes, possibly overlapping, as single-track MIDI file bytes.
+    """
+    events = []
+    for idx, (onset, duration, pitch) in enumerate(notes):
+        events.append((int(onset * ticks_per_quarter), 1, idx, 0x90, pitch, 90))
+        events.append((int((onset + duration) * ticks_per_quarter), 0, idx, 0x80, pitch, 0))
+    events.sort()  # note-offs before note-ons at the same tick, then in note order
+
+    track = bytearray()
+    tick = 0
+    for event_tick, _, _, status, pitch, velocity in events:
+        track += _write_varlen(event_tick - tick) + bytes((status, pitch, velocity))
+        tick = event_tick
+    track += b'\x00\xff\x2f\x00'
+    return (b'MThd' + struct.pack('>IHHH', 6, 1, 1, ticks_per_quarter)
+            + b'MTrk' + struct.pack('>I', len(track)) + bytes(track))
+
+
+def check_midi_engine_parity(midi_path, melody_program=0, synthetic=True):
+    """
+    Compares the 'raw' MIDI engine against the music21 engine on every MIDI file in a directory.
+
+    Parameters:
+    - midi_path (str): The directory path containing MIDI files (e.g. 'Data_example').
+    - melody_program (int, optional): The instrument index to extract. Defaults to 0.
+    - synthetic (bool, optional): Also compare the engines on the polyphonic `PARITY_CASES`, which real
+      melody corpora rarely contain. Defaults to True.
+
+    Returns:
+    - list: File (or synthetic case) names whose pitch or onset arrays differ between the two engines.
+    """
+    onlyfiles = sorted([f for f in listdir(midi_path) if isfile(join(midi_path, f))])
+    cases = [(midi_name, join(midi_path, midi_name), melody_program) for midi_name in onlyfiles]
+    mismatched_files = []
+    chord = _import_music21().chord
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if synthetic:
+            for name, notes in PARITY_CASES.items():
+                midi_file_path = join(tmp_dir, f'{name}.mid')
+                with open(midi_file_path, 'wb') as handle:
+                    handle.write(_write_note_events(notes))
+                cases.append((name, midi_file_path, 0))
+
+        for midi_name, midi_file_path, program in cases:
+            melody_m21 = get_midi(midi_file_path, program)
+            melody_raw = get_midi_raw(midi_file_path, program)
+
+            pitch_m21 = [nt.sortAscending().pitches[-1].midi if isinstance(nt, chord.Chord) else nt.pitch.midi for nt in melody_m21]
+            onset_m21 = [float(nt.offset) for nt in melody_m21]
+            pitch_raw = [nt.pitch for nt in melody_raw]
+            onset_raw = [float(nt.offset) for nt in melody_raw]
+
+            same_onsets = len(onset_m21) == len(onset_raw) and np.allclose(onset_m21, onset_raw)
+            if pitch_m21 != pitch_raw or not same_onsets:
+                print(f'MISMATCH ON {midi_name}')
+                mismatched_files.append(midi_name)
+
+    print(f'Done. {len(cases) - len(mismatched_files)} of {len(cases)} files match between engines.')
+    return mismatched_files
+
+
+def check_import_time(budget=0.5):
+    """
+    Measures the time it takes to import this module in a fresh interpreter and checks it against a budget.
+
+    Parameters:
+    - budget (float, optional): The allowed import time in seconds. Defaults to 0.5.
+
+    Returns:
+    - tuple: The measured import time in seconds and the heavy dependencies loaded by the import (empty).
+
+    Raises:
+    - AssertionError: If the import takes longer than `budget` or loads a heavy dependency.
+    """
+    heavy_modules = ['music21', 'matplotlib', 'wordcloud', 'sklearn', 'gensim']
+    code = ('import sys, time; t = time.perf_counter(); import mel2word; elapsed = time.perf_counter() - t; '
+            f'print(elapsed, *[m for m in {heavy_modules!r} if m in sys.modules])')
+    result = subprocess.run([sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                            capture_output=True, text=True, check=True)
+    elapsed, *loaded_modules = result.stdout.split()
+    elapsed = float(elapsed)
+
+    if elapsed > budget or loaded_modules:
+        raise AssertionError(f'Import time {elapsed:.3f}s (budget {budget}s), heavy modules loaded: {loaded_modules}')
+
+    print(f'Import time {elapsed:.3f}s is within the {budget}s budget.')
+    return elapsed, loaded_modules
+
+
 """## Converting MIDI to Mel2Word Format
 
 The `get_M2W_from_midipath()` function transforms a MIDI file into a Mel2Word representation. This includes options for pitch, rhythm, or both, based on the parameter: 1 (pitch), 2 (rhythm), or 3 (both - default).
@@ -255,13 +1227,21 @@ You can use the `get_M2W_dataset()` function with the `midipath` of your file to
 
 With `get_M2W_dataset()`, the data is stored as dictionaries with these keys: ['f_name', 'M2W_pitch', 'M2W_rhythm', 'M2W_all'], representing file names, transformed pitch, rhythm, and combined pitch-rhythm information.
 
+For large corpora, pass `engine='raw'` to `get_midi()`, `get_M2W_from_midipath()` or `get_M2W_dataset()` to read the notes directly from the MIDI bytes instead of building music21 streams. `check_midi_engine_parity()` verifies that both engines give the same melodies on a folder such as `Data_example`.
+
+For large batches of melodies already in memory, `get_M2W_features_batch(*get_note_arrays(melodies))` converts them all at once with NumPy and gives the same sequences as `get_M2W_features()`.
+
+Datasets can be stored in a compact columnar format with `save_dataset()` (or `convert_dataset('Tokenized_ANN_Example.pkl', 'Tokenized_ANN_Example.m2wc')`). `load_dataset()` memory-maps such files as a read-only `M2WColumnarDataset`, which decodes a melody or a feature column only when it is read.
+
 ##Mel2Word Dictionaries
 
 To tokenize your melodies, you need a dictionary. Here are examples of either loading an existing word dictionary or creating new dictionary.
 
 ###Pre-generated dictionaries
 
-If you want to use a pre-trained dictionary, you can easily load it using `load_dictionary()`. Additionally, customization is possible based on your needs, such as adjusting the existing dictionary size or maximum unit length using the `get_customed_dictionary()`. Here's the code and an example:
+If you want to use a pre-trained dictionary, you can easily load it using `load_dictionary()`. Additionally, customization is possible based on your needs, such as adjusting the existing dictionary size or maximum unit length using the `get_customed_dictionary()`.
+
+For multi-process jobs, a pickled dictionary can be converted once with `convert_dictionary('Dictionary/Dictionary_all.pkl', 'Dictionary_all.m2wd')`. `load_dictionary()` memory-maps such files as a read-only `M2WDictionary` that all processes share, and the tokenization functions accept it directly. Here's the code and an example:
 """
 
 # @title Codes for Pre-Generated Dictionaries
@@ -271,14 +1251,251 @@ def load_dictionary(path):
     Load a dictionary from a given file path.
 
     Parameters:
-    - path (str): The file path to the dictionary.
+    - path (str): The file path to the dictionary (a pickle, or a compact dictionary saved by `save_dictionary()`).
 
     Returns:
-    - dict: The loaded dictionary.
+    - dict or M2WDictionary: The loaded dictionary. Compact dictionaries are memory-mapped read-only.
     """
     with open(path, 'rb') as handle:
+        if handle.read(len(M2WDictionary.MAGIC)) == M2WDictionary.MAGIC:
+            return M2WDictionary.load(path)
+        handle.seek(0)
         return pickle.load(handle)
 
+
+def save_dictionary(dictionary, path):
+    """
+    Save a dictionary in the compact, memory-mappable M2WDictionary format.
+
+    Parameters:
+    - dictionary (dict): The dictionary to save (token: frequency).
+    - path (str): The output file path (e.g. 'Dictionary/Dictionary_all.m2wd').
+    """
+    with open(path, 'wb') as handle:
+        handle.write(M2WDictionary.encode(dictionary))
+
+
+def convert_dictionary(pkl_path, path):
+    """
+    Convert a pickled dictionary (such as 'Dictionary/Dictionary_all.pkl') to the compact M2WDictionary format.
+
+    Parameters:
+    - pkl_path (str): The pickled dictionary.
+    - path (str): The output file path.
+    """
+    with open(pkl_path, 'rb') as handle:
+        save_dictionary(pickle.load(handle), path)
+
+
+class M2WDictionary(Mapping):
+    """
+    A read-only dictionary of tokens and frequencies stored in a compact binary format.
+
+    The entries are stored sorted by frequency (ties keep the original order, like `sorted()`), with the
+    M2W units of each token as integer IDs into a shared unit table, and an index of the entries grouped by
+    token length. The file is memory-mapped, so it loads instantly and several processes share one copy of it.
+    It behaves like the pickled dictionaries (token: frequency), and `get_dictionary_by_occurrence()` selects
+    from it without sorting or splitting the tokens.
+
+    Parameters:
+    - buffer (bytes or mmap): The encoded dictionary.
+    - path (str, optional): The file the buffer is mapped from.
+    """
+
+    MAGIC = b'M2WD'
+    VERSION = 2
+    # magic, version, units, entries, unit ids, blob size, max length, then (version 2) unit id and count dtypes
+    _HEADER = struct.Struct('<4sIIIIII')
+    _DTYPES = struct.Struct('<4s4s')
+
+    def __init__(self, buffer, path=None):
+        self._buffer = buffer
+        self.path = path
+        magic, version, n_units, n_entries, n_ids, blob_size, max_len = self._HEADER.unpack_from(buffer, 0)
+        if magic != self.MAGIC or version not in (1, 2):
+            raise ValueError('Not a compact M2W dictionary (or an unsupported version).')
+
+        pos = self._HEADER.size
+        if version == 1:
+            ids_dtype, counts_dtype = '<u4', '<i8'
+        else:
+            ids_dtype, counts_dtype = (d.rstrip(b'\0').decode() for d in self._DTYPES.unpack_from(buffer, pos))
+            pos += self._DTYPES.size
+
+        sections = {}
+        for name, dtype, size in self._layout(n_units, n_entries, n_ids, blob_size, max_len, ids_dtype, counts_dtype):
+            pos += -pos % 8
+            sections[name] = np.frombuffer(buffer, dtype=dtype, count=size, offset=pos)
+            pos += sections[name].nbytes
+
+        self.counts = sections['counts']
+        self.lengths = sections['lengths']
+        self._unit_offsets = sections['unit_offsets']
+        self._id_offsets = sections['id_offsets']
+        self._ids = sections['ids']
+        self._by_length = sections['by_length']  # entry indices grouped by length, frequency order within a length
+        self._bucket_offsets = sections['bucket_offsets']
+        blob = sections['unit_blob'].tobytes().decode('utf-8')
+        self.units = [blob[self._unit_offsets[i]:self._unit_offsets[i + 1]] for i in range(n_units)]
+        self.max_length = max_len
+        self._index = None
+
+    @staticmethod
+    def _layout(n_units, n_entries, n_ids, blob_size, max_len, ids_dtype, counts_dtype):
+        return [('counts', counts_dtype, n_entries), ('unit_offsets', '<u4', n_units + 1),
+                ('id_offsets', '<u4', n_entries + 1), ('ids', ids_dtype, n_ids), ('lengths', '<u2', n_entries),
+                ('by_length', '<u4', n_entries), ('bucket_offsets', '<u4', max_len + 2),
+                ('unit_blob', 'u1', blob_size)]
+
+    @classmethod
+    def encode(cls, dictionary):
+        """
+        Encodes a dictionary (token: frequency) to the compact binary format.
+        """
+        entries = sorted(dictionary.items(), key=lambda t: t[1], reverse=True)
+        unit_ids = {}
+        ids, id_offsets, lengths = [], [0], []
+        for word, _ in entries:
+            units = word.split('_')
+            ids.extend(unit_ids.setdefault(unit, len(unit_ids)) for unit in units)
+            id_offsets.append(len(ids))
+            lengths.append(len(units))
+
+        blob = ''.join(unit_ids)
+        unit_offsets = np.cumsum([0] + [len(unit) for unit in unit_ids])
+        max_len = max(lengths, default=0)
+        lengths = np.array(lengths, dtype='<u2')
+        by_length = np.argsort(lengths, kind='stable')
+        bucket_offsets = np.searchsorted(lengths[by_length], np.arange(max_len + 2))
+
+        counts = np.array([count for _, count in entries], dtype='<i8')
+        # The smallest types that hold the unit ids and the counts
+        ids_dtype = 'u1' if len(unit_ids) <= 1 << 8 else '<u2' if len(unit_ids) <= 1 << 16 else '<u4'
+        counts_dtype = '<u4' if counts.size == 0 or (counts.min() >= 0 and counts.max() < 1 << 32) else '<i8'
+
+        arrays = {'counts': counts,
+                  'unit_offsets': unit_offsets, 'id_offsets': np.array(id_offsets), 'ids': np.array(ids),
+                  'lengths': lengths, 'by_length': by_length, 'bucket_offsets': bucket_offsets,
+                  'unit_blob': np.frombuffer(blob.encode('utf-8'), dtype='u1')}
+        blob_size = arrays['unit_blob'].size
+
+        out = bytearray(cls._HEADER.pack(cls.MAGIC, cls.VERSION, len(unit_ids), len(entries), len(ids), blob_size, max_len))
+        out += cls._DTYPES.pack(ids_dtype.encode(), counts_dtype.encode())
+        for name, dtype, size in cls._layout(len(unit_ids), len(entries), len(ids), blob_size, max_len, ids_dtype,
+                                             counts_dtype):
+            out += bytes(-len(out) % 8)
+            out += np.ascontiguousarray(arrays[name], dtype=dtype).tobytes()
+        return bytes(out)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Memory-maps a compact dictionary file read-only.
+        """
+        with open(path, 'rb') as handle:
+            buffer = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(buffer, path)
+
+    @classmethod
+    def from_dict(cls, dictionary):
+        return cls(cls.encode(dictionary))
+
+    def __reduce__(self):
+        # Worker processes map the same file instead of receiving a copy
+        if self.path is not None:
+            return (M2WDictionary.load, (self.path,))
+        return (M2WDictionary, (bytes(self._buffer),))
+
+    def token(self, idx):
+        """
+        Returns the token string of the entry at a frequency rank.
+        """
+        ids = self._ids[self._id_offsets[idx]:self._id_offsets[idx + 1]]
+        return '_'.join([self.units[i] for i in ids])
+
+    def __len__(self):
+        return len(self.counts)
+
+    def __iter__(self):
+        return (self.token(idx) for idx in range(len(self)))
+
+    def __getitem__(self, word):
+        if self._index is None:
+            self._index = {token: idx for idx, token in enumerate(self)}
+        return int(self.counts[self._index[word]])
+
+    def most_frequent(self):
+        """
+        Returns the most frequent token (the first one when several share the highest frequency).
+        """
+        return self.token(0)
+
+    def select(self, dic_size, min_freq=10, max_length=10):
+        """
+        Selects the `dic_size` most frequent tokens of 2 to `max_length` units occurring more than `min_freq` times,
+        like `get_dictionary_by_occurrence()`, using the length buckets.
+
+        Returns:
+        - dict: The selected tokens and their frequencies, in frequency order.
+        """
+        selected = []
+        for lth in range(2, min(max_length, self.max_length) + 1):
+            bucket = self._by_length[self._bucket_offsets[lth]:self._bucket_offsets[lth + 1]]
+            # counts are non-increasing within a bucket, so the frequent enough entries are a prefix
+            keep = np.searchsorted(-self.counts[bucket].astype(np.int64), -min_freq, side='left')
+            selected.append(bucket[:keep])
+        selected = np.sort(np.concatenate(selected)) if selected else np.array([], dtype=int)
+        if dic_size >= 1:
+            selected = selected[:dic_size]
+        return {self.token(idx): int(self.counts[idx]) for idx in selected}
+
+def select_frequent_tokens(dictionary, dic_size, min_freq=10, max_length=10):
+    """
+    Select the most frequent tokens of a dictionary without sorting all of it.
+
+    The frequencies are filtered and partially selected with NumPy (`np.partition`), so only the most frequent
+    candidates are ordered and only their token lengths are computed; the candidate pool grows if too many of them
+    fail the length filter. The selection and its order are the same as sorting the whole dictionary by frequency
+    (ties in dictionary order) and keeping the first `dic_size` tokens that pass.
+
+    Parameters:
+    - dictionary (dict or M2WDictionary): The input dictionary containing token occurrences.
+    - dic_size (int): The desired size of the resulting dictionary.
+    - min_freq (int): The minimum number of occurrences (frequency) for a token to be included in the dictionary.
+    - max_length (int): The maximum length (number of tokens) a token can have to be included in the dictionary.
+
+    Returns:
+    - dict: The selected tokens and their frequencies, in frequency order.
+    """
+    if isinstance(dictionary, M2WDictionary):
+        return dictionary.select(dic_size, min_freq, max_length)
+
+    words = list(dictionary)
+    counts = np.fromiter(dictionary.values(), dtype=np.float64, count=len(words))
+    eligible = np.flatnonzero(counts > min_freq)
+
+    pool = dic_size if dic_size >= 1 else len(eligible)
+    while True:
+        if pool < len(eligible):
+            # Everything at least as frequent as the pool-th most frequent token (ties included)
+            threshold = -np.partition(-counts[eligible], pool - 1)[pool - 1]
+            candidates = eligible[counts[eligible] >= threshold]
+        else:
+            candidates = eligible
+        candidates = candidates[np.lexsort((candidates, -counts[candidates]))]
+
+        vocs = {}
+        for idx in candidates:
+            word = words[idx]
+            if 1 < word.count('_') + 1 <= max_length:
+                vocs[word] = dictionary[word]
+                if len(vocs) == dic_size:
+                    return vocs
+
+        if len(candidates) == len(eligible):
+            return vocs
+        pool *= 2
+
 def get_customed_dictionary(dictionary, dic_size, min_freq=10, max_length=10):
     """
     Build a custom dictionary.
@@ -293,15 +1510,7 @@ def get_customed_dictionary(dictionary, dic_size, min_freq=10, max_length=10):
     - dict: The built custom dictionary.
     """
 
-    sorted_vocs = sorted(dictionary.items(), key=lambda t: t[1], reverse=True)
-
-    vocs = {}
-    for idx, (word, count) in enumerate(sorted_vocs):
-        if len(word.split('_')) <= max_length and len(word.split('_')) > 1 and count > min_freq:
-            vocs[word] = count
-            if len(vocs) == dic_size:
-                break
-
+    vocs = select_frequent_tokens(dictionary, dic_size, min_freq, max_length)
 
     if dic_size > len(vocs):
         print('Dictionary size too large..Get full-size dictionary of..', len(vocs))
@@ -312,12 +1521,16 @@ def get_customed_dictionary(dictionary, dic_size, min_freq=10, max_length=10):
 
 """###Generate new dictionary
 You can create a new dictionary using your own dataset. The functions `BPE()` convert the dataset into the Mel2Word format and use Byte-Pair Encoding (BPE) to generate the dictionary. With `BPE()`, you obtain a dictionary in the form of a dictionary with the structure 'M2W: Frequency'.
+For large datasets, `BPE(..., engine='sharded', n_jobs=4)` trains on shards of the dataset in parallel worker processes and builds the same dictionary.
+Long runs can be checkpointed with `BPE(..., checkpoint='bpe_all.ckpt')`: an interrupted run resumes from the checkpoint, and a finished one is extended with more merges by calling `BPE()` again with a larger `dic_size`.
+When new melodies are added to the dataset, `update_BPE('bpe_all.ckpt', new_db)` applies the known merges to the new melodies only and updates the frequencies.
 """
 
 # @title Codes for generating new dictionary
 
 
-def BPE(db, feat=3, dic_size=100, min_freq=10, max_length=11):
+def BPE(db, feat=3, dic_size=100, min_freq=10, max_length=11, engine='incremental', n_jobs=None, checkpoint=None,
+        checkpoint_freq=1000):
     """
     Builds a dictionary using Byte-Pair Encoding on a given dataset.
 
@@ -327,10 +1540,24 @@ def BPE(db, feat=3, dic_size=100, min_freq=10, max_length=11):
     - dic_size (int, optional): The desired size of the resulting byte-pair dictionary. Defaults to 100.
     - min_freq (int, optional): The minimum frequency threshold for byte-pairs to be considered during dictionary construction. Defaults to 10.
     - max_length (int, optional): The maximum length of byte-pairs to be considered during dictionary construction. Defaults to 11.
+    - engine (str, optional): 'incremental' keeps pair counts up to date and only re-encodes the melodies touched
+      by each merge (see `merge_bytepairs_incremental()`); 'recount' recounts every pair of the dataset on each
+      iteration; 'sharded' splits the dataset over `n_jobs` worker processes (see `merge_bytepairs_sharded()`).
+      All of them build the same dictionary. Defaults to 'incremental'.
+    - n_jobs (int, optional): Number of worker processes for the 'sharded' engine; None uses all CPU cores. Defaults to None.
+    - checkpoint (str, optional): A checkpoint file (see `save_bpe_checkpoint()`). If it exists, training resumes
+      from it; a finished run is extended with more merges by calling `BPE()` again with a larger `dic_size`, and a
+      smaller `dic_size` returns the dictionary of the first `dic_size` merges. `min_freq` and `max_length` must be
+      those of the run that wrote it. The training state is saved to it every `checkpoint_freq` merges and at the
+      end. Defaults to None (no checkpoints).
+    - checkpoint_freq (int, optional): Number of merges between checkpoints. Defaults to 1000.
 
     Returns:
     - dict: The generated dictionary.
     """
+    if engine not in ('incremental', 'recount', 'sharded'):
+        raise ValueError(f"Unknown BPE engine '{engine}'. Use 'incremental', 'recount' or 'sharded'.")
+
     words = []
 
     feat_mapping = {1: 'pitch', 2: 'rhythm', 3: 'all'}
@@ -343,34 +1570,61 @@ def BPE(db, feat=3, dic_size=100, min_freq=10, max_length=11):
     bpvocs = len(Counter(words).keys())
     print('starting byte-paring with iteration of..', dic_size, 'for', feat_str)
 
-    db, bp_stat = prep_for_bytepair(db, feat_str)
+    bp_stat = None
+    save = None
+    if checkpoint is not None:
+        save = partial(save_bpe_checkpoint, checkpoint, feat=feat_str, min_freq=min_freq, max_length=max_length)
+        if os.path.exists(checkpoint):
+            bp_stat = load_bpe_checkpoint(checkpoint, db, feat_str, min_freq, max_length)
+            print('Resuming from', checkpoint, 'with', len(bp_stat), 'merges..')
+
+    if bp_stat is not None and 1 < dic_size <= len(bp_stat):
+        print('The checkpoint already has', len(bp_stat), 'merges..')
+        # The merges are in merge order, so the first dic_size of them are those of a shorter run. The checkpoint
+        # (and the restored 'bped' sequences) keep all of its merges, so it is not saved again.
+        bp_stat = dict(list(bp_stat.items())[:dic_size])
+        save = None
+    elif engine == 'sharded':
+        bp_stat = merge_bytepairs_sharded(db, feat_str, dic_size, min_freq, max_length, n_jobs, bp_stat, save, checkpoint_freq)
+    else:
+        if bp_stat is None:
+            db, bp_stat = prep_for_bytepair(db, feat_str)
 
-    while True:
-        # Get the most frequent byte-pair
-        bpword, pre_freq = get_bped_word(db, 'bped', bp_stat, max_length)
+        if engine == 'incremental':
+            bp_stat = merge_bytepairs_incremental(db, bp_stat, dic_size, min_freq, max_length, save, checkpoint_freq)
+        else:
+            while True:
+                # Get the most frequent byte-pair
+                bpword, pre_freq = get_bped_word(db, 'bped', bp_stat, max_length)
 
-        # Break the loop if the frequency is below the specified minimum
-        if pre_freq <= min_freq:
-            break
+                # Break the loop if the frequency is below the specified minimum
+                if pre_freq <= min_freq:
+                    break
 
-        tfreq = 0
+                tfreq = 0
 
-        # Apply the byte-pair encoding to each MIDI in the dataset
-        for midi in db:
-            midi['bped'], freq = encode_bytepair(midi['bped'], bpword)
-            tfreq += freq
+                # Apply the byte-pair encoding to each MIDI in the dataset
+                for midi in db:
+                    midi['bped'], freq = encode_bytepair(midi['bped'], bpword)
+                    tfreq += freq
 
-        bp_stat[bpword] = tfreq
-        vocsize = len(bp_stat)
+                bp_stat[bpword] = tfreq
+                vocsize = len(bp_stat)
 
-        if vocsize % 100 == 0:
-            print(vocsize, 'done...')
+                if vocsize % 100 == 0:
+                    print(vocsize, 'done...')
 
-        if vocsize == dic_size:
-            dictionary = {}
-            dictionary.update(bp_stat)
-            dictionary.update(dict(Counter(words)))
-            break
+                if vocsize == dic_size:
+                    dictionary = {}
+                    dictionary.update(bp_stat)
+                    dictionary.update(dict(Counter(words)))
+                    break
+
+                if save is not None and vocsize % checkpoint_freq == 0:
+                    save(db, bp_stat)
+
+    if save is not None:
+        save(db, bp_stat)
 
     dictionary = {}
     dictionary.update(bp_stat)
@@ -462,34 +1716,598 @@ def get_bped_word(db, mode, bp_list=None, max_bp_len=12):
     if bp_list is not None:
         return check_bped_word(sfreq, bp_list)
 
-    return sfreq[0][0], sfreq[0][1]
+    return sfreq[0][0], sfreq[0][1]
+
+
+def prep_for_bytepair(db, feat):
+    """
+    Prepares a dataset for byte-pair encoding.
+
+    Parameters:
+    - db (list): The database to be prepared.
+    - feat (str): The feature to be considered in the database.
+
+    Returns:
+    - tuple: A tuple containing the prepared database and byte-pair statistics.
+    """
+    bp_stat = {}
+
+    # Get the initial byte-pair
+    bpword, pre_freq = get_bped_word(db, 'M2W_' + feat)
+
+    tfreq = 0
+
+    # Apply the byte-pair encoding to each MIDI in the dataset
+    for midi in db:
+        midi['bped'], freq = encode_bytepair(midi['M2W_' + feat], bpword)
+        tfreq += freq
+
+    bp_stat[bpword] = tfreq
+    return db, bp_stat
+
+
+def _bpe_dataset_fingerprint(db, feat, fingerprint=''):
+    # Chained per melody, so the fingerprint of a grown dataset follows from the fingerprint of its first part
+    for midi in db:
+        fingerprint = hashlib.sha256(fingerprint.encode() + '.'.join(midi['M2W_' + feat]).encode()).hexdigest()
+    return fingerprint
+
+
+def save_bpe_checkpoint(path, db, bp_stat, feat='all', min_freq=None, max_length=None):
+    """
+    Saves the training state of `BPE()`: the merges so far (in merge order, with frequencies) and the 'bped'
+    sequence of every melody. The file is replaced atomically, so an interrupted save keeps the previous checkpoint.
+
+    Parameters:
+    - path (str): The checkpoint file path.
+    - db (list): The dataset being encoded, with up-to-date 'bped' sequences.
+    - bp_stat (dict): The byte-pair statistics.
+    - feat (str, optional): The encoded feature ('pitch', 'rhythm' or 'all'). Defaults to 'all'.
+    - min_freq (int, optional): The minimum frequency of the training run, checked on resume. Defaults to None.
+    - max_length (int, optional): The maximum byte-pair length of the training run, checked on resume. Defaults to None.
+    """
+    state = {'feat': feat,
+             'fingerprint': _bpe_dataset_fingerprint(db, feat),
+             'min_freq': min_freq,
+             'max_length': max_length,
+             'bp_stat': bp_stat,
+             'bped': [midi['bped'] for midi in db]}
+    _write_bpe_state(path, state)
+
+
+def _write_bpe_state(path, state):
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as handle:
+        pickle.dump(state, handle, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+def _check_bpe_state(state, feat, min_freq=None, max_length=None):
+    # The merges of a checkpoint only continue a run made with the same feature and merge rules
+    if state['feat'] != feat:
+        raise ValueError(f"The checkpoint was made for the '{state['feat']}' feature, not '{feat}'.")
+    for name, value in (('min_freq', min_freq), ('max_length', max_length)):
+        if value is not None and state.get(name) is not None and state[name] != value:
+            raise ValueError(f'The checkpoint was made with {name}={state[name]}, not {value}.')
+
+
+def load_bpe_checkpoint(path, db, feat='all', min_freq=None, max_length=None):
+    """
+    Restores the training state saved by `save_bpe_checkpoint()` into a dataset.
+
+    Parameters:
+    - path (str): The checkpoint file path.
+    - db (list): The dataset the checkpoint was made for; its 'bped' sequences are restored in place.
+    - feat (str, optional): The encoded feature ('pitch', 'rhythm' or 'all'). Defaults to 'all'.
+    - min_freq (int, optional): If given, must match the minimum frequency the checkpoint was made with. Defaults to None.
+    - max_length (int, optional): If given, must match the maximum length the checkpoint was made with. Defaults to None.
+
+    Returns:
+    - dict: The byte-pair statistics, in merge order.
+    """
+    with open(path, 'rb') as handle:
+        state = pickle.load(handle)
+
+    _check_bpe_state(state, feat, min_freq, max_length)
+    if state['fingerprint'] != _bpe_dataset_fingerprint(db, feat):
+        raise ValueError('The checkpoint was made for a different dataset.')
+
+    for midi, bped in zip(db, state['bped']):
+        midi['bped'] = list(bped)
+    return state['bp_stat']
+
+
+def update_BPE(checkpoint, new_db, feat=3, dic_size=None, min_freq=10, max_length=11):
+    """
+    Updates a BPE dictionary with newly added melodies, without encoding the whole dataset again.
+
+    The merges of the checkpoint are replayed, in merge order, on the new melodies only (see `_BPEShard`), and their
+    frequencies in the new melodies are added to the dictionary. Since merges are applied to each melody on its own,
+    the new 'bped' sequences are the ones a training over the whole dataset would give with the same merges. The
+    merge order itself is kept as it is, so the result can differ from retraining from scratch on the grown dataset.
+    The checkpoint is then rewritten for the grown dataset (old melodies followed by `new_db`), so it can be resumed
+    with `BPE(old_db + new_db, ..., checkpoint=checkpoint)`.
+
+    If `dic_size` is larger than the number of merges, more merges are learned over the grown dataset with
+    `merge_bytepairs_incremental()`; unlike the replay, this counts the pairs of the whole dataset once.
+
+    Only the encoding work scales with the new melodies. The checkpoint is a single pickle holding the 'bped'
+    sequences of every melody, so each update still reads it whole into memory and writes it back: the I/O and the
+    memory use grow with the whole corpus, even when `dic_size` is None.
+
+    Parameters:
+    - checkpoint (str): A checkpoint written by `BPE(..., checkpoint=...)`; updated in place.
+    - new_db (list): The new melodies with their M2W representations; 'bped' sequences are added in place.
+    - feat (int, optional): The feature to consider (1 for 'pitch', 2 for 'rhythm', 3 for 'all'). Defaults to 3.
+    - dic_size (int, optional): The desired size of the byte-pair dictionary. Defaults to None (no new merges).
+    - min_freq (int, optional): The minimum frequency threshold for new byte-pairs; must match the checkpoint. Defaults to 10.
+    - max_length (int, optional): The maximum length of new byte-pairs; must match the checkpoint. Defaults to 11.
+
+    Returns:
+    - dict: The updated dictionary.
+    """
+    feat_mapping = {1: 'pitch', 2: 'rhythm', 3: 'all'}
+    feat_str = feat_mapping.get(feat, 'all')
+
+    with open(checkpoint, 'rb') as handle:
+        state = pickle.load(handle)
+    _check_bpe_state(state, feat_str, min_freq, max_length)
+    bp_stat = state['bp_stat']
+    print('Updating', len(bp_stat), 'merges with', len(new_db), 'new melodies..')
+
+    # Every merged pair has to be indexed, whatever max_length the dictionary was trained with
+    merged_length = max([bp_word.count('_') + 1 for bp_word in bp_stat], default=2)
+    shard = _BPEShard([midi['M2W_' + feat_str] for midi in new_db], 0, max(merged_length, max_length))
+    for bp_word in bp_stat:
+        bp_stat[bp_word] += shard.merge(bp_word)[0]
+    for midi, bped in zip(new_db, shard.decode()):
+        midi['bped'] = bped
+
+    db = [{'bped': list(bped)} for bped in state['bped']] + new_db
+    if dic_size is not None and dic_size > len(bp_stat):
+        bp_stat = merge_bytepairs_incremental(db, bp_stat, dic_size, min_freq, max_length)
+
+    state = {'feat': feat_str,
+             'fingerprint': _bpe_dataset_fingerprint(new_db, feat_str, state['fingerprint']),
+             'min_freq': min_freq,
+             'max_length': max_length,
+             'bp_stat': bp_stat,
+             'bped': [midi['bped'] for midi in db]}
+    _write_bpe_state(checkpoint, state)
+
+    token_dictionary = {k: v for k, v in sorted(bp_stat.items(), key=lambda item: item[1], reverse=True) if '_' in k}
+    print('BPE dictionary was updated to', len(token_dictionary), 'of tokens')
+
+    return token_dictionary
+
+class M2WVocabulary:
+    """
+    Integer IDs for M2W tokens, so melodies can be stored as compact int arrays during byte-pair encoding.
+
+    Single M2W units and merged tokens ('U02100_D01050') share one ID table. The ID of a merged pair is
+    cached per (left, right) ID pair; different bracketings of the same units map to the same ID, just as
+    they map to the same string.
+    """
+
+    def __init__(self):
+        self.tokens = []  # id -> token string
+        self.ids = {}  # token string -> id
+        self.units = []  # id -> number of M2W units in the token
+        self.pairs = {}  # (left id, right id) -> merged id
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def get_id(self, token):
+        token_id = self.ids.get(token)
+        if token_id is None:
+            token_id = self.ids[token] = len(self.tokens)
+            self.tokens.append(token)
+            self.units.append(token.count('_') + 1)
+        return token_id
+
+    def get_pair_id(self, left, right):
+        pair_id = self.pairs.get((left, right))
+        if pair_id is None:
+            pair_id = self.pairs[(left, right)] = self.get_id(self.tokens[left] + '_' + self.tokens[right])
+        return pair_id
+
+    def encode(self, seq):
+        return array('i', [self.get_id(token) for token in seq])
+
+    def decode(self, seq):
+        return [self.tokens[token_id] for token_id in seq]
+
+
+def encode_bytepair_ids(seq, target_id, vocab):
+    """
+    Encodes an integer ID sequence in place by replacing a specified byte-pair with a single token.
+
+    This gives the same result as `encode_bytepair()` on the equivalent string sequence: only the first
+    matching (left, right) pair is replaced, occurrences at the very start are merged only when the first
+    match is there, and the last two tokens are never merged.
+
+    Parameters:
+    - seq (array): The ID sequence to be encoded (modified in place).
+    - target_id (int): The vocabulary ID of the byte-pair to be encoded.
+    - vocab (M2WVocabulary): The vocabulary of the IDs.
+
+    Returns:
+    - int: The count of the encoded byte-pair in the sequence.
+    """
+    units = vocab.units
+    target_units = units[target_id]
+
+    for idx in range(len(seq) - 1):
+        if units[seq[idx]] + units[seq[idx + 1]] == target_units and vocab.get_pair_id(seq[idx], seq[idx + 1]) == target_id:
+            break
+    else:
+        return 0
+
+    left, right = seq[idx], seq[idx + 1]
+
+    # Two passes of merging pairs surrounded by other tokens ('.left.right.' in the string version)
+    for _ in range(2):
+        n = len(seq)
+        read = write = 0
+        next_free = 1  # the first token has no leading separator
+        while read < n:
+            if read >= next_free and read + 2 < n and seq[read] == left and seq[read + 1] == right:
+                seq[write] = target_id
+                read += 2
+                next_free = read + 1
+            else:
+                seq[write] = seq[read]
+                read += 1
+            write += 1
+        del seq[write:]
+
+    # Exception (begin): any token ending with the left token is merged with a following right token
+    if idx == 0:
+        left_str = vocab.tokens[left]
+        n = len(seq)
+        read = write = 0
+        while read < n:
+            if (read + 2 < n and seq[read + 1] == right
+                    and (seq[read] == left or vocab.tokens[seq[read]].endswith(left_str))):
+                seq[write] = vocab.get_pair_id(seq[read], right)
+                read += 2
+            else:
+                seq[write] = seq[read]
+                read += 1
+            write += 1
+        del seq[write:]
+
+    return seq.count(target_id)
+
+
+class _BPEShard:
+    """
+    A contiguous shard of the dataset, with incrementally maintained byte-pair statistics.
+
+    The shard holds its melodies as integer ID arrays (see `M2WVocabulary`) and keeps the counts of its byte-pairs,
+    the melodies each pair occurs in and the first occurrence of each pair up to date as merges are applied. It is the
+    whole dataset (offset 0) for `merge_bytepairs_incremental()` and `update_BPE()`, and one worker's part of it for
+    `merge_bytepairs_sharded()`, where pairs are exchanged as strings, since every shard has its own vocabulary.
+    """
+
+    def __init__(self, seqs, offset, max_length):
+        self.vocab = M2WVocabulary()
+        self.seqs = [self.vocab.encode(seq) for seq in seqs]
+        self.offset = offset  # index of the shard's first melody in the dataset
+        self.max_length = max_length
+        self.counts = {}  # pair id -> frequency in the shard
+        self.pair_melodies = {}  # pair id -> {melody index: frequency}
+        self.first_melody = {}  # pair id -> index of the first melody containing the pair
+        self.first_pos = []  # melody index -> {pair id: first position in that melody}
+
+        for midx, seq in enumerate(self.seqs):
+            pairs, positions = self.melody_pairs(seq)
+            self.first_pos.append(positions)
+            for pair_id, freq in pairs.items():
+                self.counts[pair_id] = self.counts.get(pair_id, 0) + freq
+                self.pair_melodies.setdefault(pair_id, {})[midx] = freq
+                self.first_melody.setdefault(pair_id, midx)
+
+    def melody_pairs(self, seq):
+        units = self.vocab.units
+        pairs = Counter()
+        positions = {}
+        for idx in range(len(seq) - 1):
+            if units[seq[idx]] + units[seq[idx + 1]] <= self.max_length:
+                pair_id = self.vocab.get_pair_id(seq[idx], seq[idx + 1])
+                pairs[pair_id] += 1
+                positions.setdefault(pair_id, idx)
+        return pairs, positions
+
+    def stat(self, pair_id):
+        """(count, first melody in the dataset, first position) of a pair; the count is 0 if it is gone."""
+        if self.counts.get(pair_id, 0) <= 0:
+            return 0, None, None
+        fm = self.first_melody[pair_id]
+        return self.counts[pair_id], self.offset + fm, self.first_pos[fm][pair_id]
+
+    def stats(self):
+        return {self.vocab.tokens[pair_id]: self.stat(pair_id) for pair_id, count in self.counts.items() if count > 0}
+
+    def merge_id(self, bpid):
+        """
+        Merges a pair (by ID) in the melodies containing it.
+
+        Returns:
+        - tuple: The frequency of the merged pair and the set of pair IDs whose statistics changed.
+        """
+        tfreq = 0
+        changed = set()
+        pair_melodies, first_melody, first_pos = self.pair_melodies, self.first_melody, self.first_pos
+
+        for midx in sorted(pair_melodies.get(bpid, ())):
+            old_positions = first_pos[midx]
+            tfreq += encode_bytepair_ids(self.seqs[midx], bpid, self.vocab)
+            new_pairs, new_positions = self.melody_pairs(self.seqs[midx])
+            first_pos[midx] = new_positions
+
+            for pair_id in set(old_positions) | set(new_positions):
+                old_freq = pair_melodies.get(pair_id, {}).get(midx, 0)
+                new_freq = new_pairs.get(pair_id, 0)
+                if new_freq:
+                    pair_melodies.setdefault(pair_id, {})[midx] = new_freq
+                    if first_melody.get(pair_id, midx) >= midx:
+                        first_melody[pair_id] = midx
+                else:
+                    del pair_melodies[pair_id][midx]
+                    if first_melody[pair_id] == midx:
+                        if pair_melodies[pair_id]:
+                            first_melody[pair_id] = min(pair_melodies[pair_id])
+                        else:
+                            del pair_melodies[pair_id], first_melody[pair_id]
+                self.counts[pair_id] = self.counts.get(pair_id, 0) + new_freq - old_freq
+                if new_freq != old_freq or first_melody.get(pair_id) == midx:
+                    changed.add(pair_id)
+
+        return tfreq, changed
+
+    def merge(self, bp_word):
+        """
+        Merges a pair (by string) and returns its frequency and the changed pair stats, keyed by string.
+        """
+        bpid = self.vocab.ids.get(bp_word)
+        if bpid is None or not self.pair_melodies.get(bpid):
+            return 0, {}
+        tfreq, changed = self.merge_id(bpid)
+        return tfreq, {self.vocab.tokens[pair_id]: self.stat(pair_id) for pair_id in changed}
+
+    def decode(self):
+        return [self.vocab.decode(seq) for seq in self.seqs]
+
+
+def merge_bytepairs_incremental(db, bp_stat, dic_size=100, min_freq=10, max_length=11, checkpoint=None,
+                                checkpoint_freq=1000):
+    """
+    Runs the byte-pair merge iterations of `BPE()` with incrementally maintained pair counts.
+
+    Instead of recounting and sorting every byte-pair of the dataset on each iteration, the pair counts,
+    the melodies each pair occurs in and the first occurrence of each pair are kept up to date by a single
+    `_BPEShard` over the whole dataset, and only the melodies containing the merged pair are re-encoded. The most
+    frequent pair is taken from a priority queue ordered like `get_bped_word()` (count, then first occurrence), so
+    the merges are the same as in `BPE()`. The melodies are held as integer ID arrays (see `M2WVocabulary`) and
+    merged in place with `encode_bytepair_ids()`; strings are only built for the dictionary and the final 'bped'
+    sequences.
+
+    Parameters:
+    - db (list): The dataset prepared by `prep_for_bytepair()`; each 'bped' sequence is updated in place.
+    - bp_stat (dict): The byte-pair statistics from `prep_for_bytepair()`; updated in place.
+    - dic_size (int, optional): The desired size of the resulting byte-pair dictionary. Defaults to 100.
+    - min_freq (int, optional): The minimum frequency threshold for byte-pairs. Defaults to 10.
+    - max_length (int, optional): The maximum length of byte-pairs. Defaults to 11.
+    - checkpoint (callable, optional): Called as `checkpoint(db, bp_stat)` every `checkpoint_freq` merges, after the
+      'bped' sequences of `db` are brought up to date. Defaults to None.
+    - checkpoint_freq (int, optional): Number of merges between checkpoints. Defaults to 1000.
+
+    Returns:
+    - dict: The byte-pair statistics.
+    """
+    shard = _BPEShard([midi['bped'] for midi in db], 0, max_length)
+    merged = {shard.vocab.get_id(bp_word) for bp_word in bp_stat}
+    heap = []
+
+    def push(pair_id):
+        count, fm, fp = shard.stat(pair_id)
+        if count > 0 and pair_id not in merged:
+            heapq.heappush(heap, (-count, fm, fp, pair_id))
+
+    for pair_id in shard.counts:
+        push(pair_id)
+
+    while True:
+        # Get the most frequent byte-pair, skipping outdated queue entries
+        bpid = None
+        while heap:
+            entry = heapq.heappop(heap)
+            pair_id = entry[3]
+            if pair_id in merged:
+                continue
+            count, fm, fp = shard.stat(pair_id)
+            if (-count, fm, fp) != entry[:3]:
+                continue
+            bpid, pre_freq = pair_id, count
+            break
+
+        # Break the loop if no pair is left or the frequency is below the specified minimum
+        if bpid is None or pre_freq <= min_freq:
+            break
+
+        # Apply the byte-pair encoding only to the melodies containing the pair
+        merged.add(bpid)
+        tfreq, changed = shard.merge_id(bpid)
+        for pair_id in changed:
+            push(pair_id)
+
+        bp_stat[shard.vocab.tokens[bpid]] = tfreq
+        vocsize = len(bp_stat)
+
+        if vocsize % 100 == 0:
+            print(vocsize, 'done...')
+
+        if vocsize == dic_size:
+            break
+
+        if checkpoint is not None and vocsize % checkpoint_freq == 0:
+            for midi, bped in zip(db, shard.decode()):
+                midi['bped'] = bped
+            checkpoint(db, bp_stat)
+
+    for midi, bped in zip(db, shard.decode()):
+        midi['bped'] = bped
+
+    return bp_stat
+
+
+def _bpe_shard_worker(conn, seqs, offset, max_length):
+    """
+    Serves one `_BPEShard` over a pipe: ('merge', pair) -> (frequency, changed stats); ('bped',) and ('finish',)
+    -> the current sequences, the latter also stopping the worker.
+    """
+    shard = _BPEShard(seqs, offset, max_length)
+    conn.send(shard.stats())
+    while True:
+        command = conn.recv()
+        if command[0] == 'merge':
+            conn.send(shard.merge(command[1]))
+        else:
+            conn.send(shard.decode())
+            if command[0] == 'finish':
+                break
+    conn.close()
 
 
-def prep_for_bytepair(db, feat):
+def merge_bytepairs_sharded(db, feat, dic_size=100, min_freq=10, max_length=11, n_jobs=None, bp_stat=None,
+                            checkpoint=None, checkpoint_freq=1000):
     """
-    Prepares a dataset for byte-pair encoding.
+    Runs all byte-pair merges of `BPE()` (including the first one of `prep_for_bytepair()`) over dataset shards
+    held by worker processes.
+
+    The dataset is split into contiguous shards of about the same number of M2W units, one per worker. Each worker
+    keeps the pair counts of its shard and applies the merges locally (see `_BPEShard`); the coordinator merges the
+    per-shard counts, picks the globally most frequent pair that is not in the dictionary yet, with ties broken by
+    first occurrence like `get_bped_word()`/`check_bped_word()`, and sends it to the shards that contain it. The
+    `max_length` and `min_freq` rules are those of the serial trainer, so the dictionary and the 'bped' sequences are
+    the same as with the 'incremental' or 'recount' engine.
 
     Parameters:
-    - db (list): The database to be prepared.
-    - feat (str): The feature to be considered in the database.
+    - db (list): The dataset containing M2W representations for each MIDI file; 'bped' sequences are added in place.
+    - feat (str): The feature to encode ('pitch', 'rhythm' or 'all').
+    - dic_size (int, optional): The desired size of the resulting byte-pair dictionary. Defaults to 100.
+    - min_freq (int, optional): The minimum frequency threshold for byte-pairs. Defaults to 10.
+    - max_length (int, optional): The maximum length of byte-pairs. Defaults to 11.
+    - n_jobs (int, optional): Number of shards (worker processes); None uses all CPU cores. Defaults to None.
+    - bp_stat (dict, optional): The byte-pair statistics of a resumed run, whose 'bped' sequences are in `db`; updated
+      in place. Defaults to None (start from the M2W sequences).
+    - checkpoint (callable, optional): Called as `checkpoint(db, bp_stat)` every `checkpoint_freq` merges, after the
+      'bped' sequences of `db` are brought up to date. Defaults to None.
+    - checkpoint_freq (int, optional): Number of merges between checkpoints. Defaults to 1000.
 
     Returns:
-    - tuple: A tuple containing the prepared database and byte-pair statistics.
+    - dict: The byte-pair statistics.
     """
-    bp_stat = {}
+    seqs = [midi['M2W_' + feat] if bp_stat is None else midi['bped'] for midi in db]
+    n_shards = max(1, min(n_jobs or os.cpu_count() or 1, len(seqs)))
 
-    # Get the initial byte-pair
-    bpword, pre_freq = get_bped_word(db, 'M2W_' + feat)
+    # Contiguous shards with about the same number of units, so the first occurrences keep the dataset order
+    lengths = np.cumsum([len(seq) for seq in seqs])
+    cuts = [0] + [int(np.searchsorted(lengths, lengths[-1] * i / n_shards)) + 1 for i in range(1, n_shards)] + [len(seqs)]
+    bounds = [(start, stop) for start, stop in zip(cuts, cuts[1:]) if start < stop]
 
-    tfreq = 0
+    workers = []
+    conns = []
+    try:
+        for start, stop in bounds:
+            parent_conn, child_conn = Pipe()
+            worker = Process(target=_bpe_shard_worker, args=(child_conn, seqs[start:stop], start, max_length), daemon=True)
+            worker.start()
+            child_conn.close()
+            workers.append(worker)
+            conns.append(parent_conn)
+
+        shard_stats = {}  # pair -> {shard: (count, first melody, first position)}
+        bp_stat = {} if bp_stat is None else bp_stat
+        heap = []
+
+        def global_key(bp_word):
+            stats = shard_stats.get(bp_word)
+            if not stats:
+                return None
+            fm, fp = min((stat[1], stat[2]) for stat in stats.values())
+            return -sum(stat[0] for stat in stats.values()), fm, fp
+
+        def update(shard, stats):
+            for bp_word, stat in stats.items():
+                if stat[0] > 0:
+                    shard_stats.setdefault(bp_word, {})[shard] = stat
+                elif bp_word in shard_stats:
+                    shard_stats[bp_word].pop(shard, None)
+                    if not shard_stats[bp_word]:
+                        del shard_stats[bp_word]
+                key = global_key(bp_word)
+                if key is not None and bp_word not in bp_stat:
+                    heapq.heappush(heap, key + (bp_word,))
+
+        def fetch_bped(command):
+            for conn, (start, stop) in zip(conns, bounds):
+                conn.send((command,))
+                for midi, bped in zip(db[start:stop], conn.recv()):
+                    midi['bped'] = bped
+
+        for shard, conn in enumerate(conns):
+            update(shard, conn.recv())
+
+        while True:
+            # Get the globally most frequent byte-pair, skipping outdated queue entries
+            bpword = None
+            while heap:
+                entry = heapq.heappop(heap)
+                if entry[3] not in bp_stat and global_key(entry[3]) == entry[:3]:
+                    bpword, pre_freq = entry[3], -entry[0]
+                    break
+
+            # The first merge (prep_for_bytepair) has no frequency threshold
+            if bpword is None or (bp_stat and pre_freq <= min_freq):
+                break
 
-    # Apply the byte-pair encoding to each MIDI in the dataset
-    for midi in db:
-        midi['bped'], freq = encode_bytepair(midi['M2W_' + feat], bpword)
-        tfreq += freq
+            holders = list(shard_stats[bpword])
+            for shard in holders:
+                conns[shard].send(('merge', bpword))
+            tfreq = 0
+            for shard in holders:
+                freq, stats = conns[shard].recv()
+                tfreq += freq
+                update(shard, stats)
+
+            bp_stat[bpword] = tfreq
+            vocsize = len(bp_stat)
+
+            if vocsize > 1:
+                if vocsize % 100 == 0:
+                    print(vocsize, 'done...')
+
+                if vocsize == dic_size:
+                    break
+
+                if checkpoint is not None and vocsize % checkpoint_freq == 0:
+                    fetch_bped('bped')
+                    checkpoint(db, bp_stat)
+
+        fetch_bped('finish')
+    finally:
+        for conn in conns:
+            conn.close()
+        for worker in workers:
+            worker.join(timeout=5)
+            if worker.is_alive():
+                worker.terminate()
+
+    return bp_stat
 
-    bp_stat[bpword] = tfreq
-    return db, bp_stat
 
 """##Tokenization
 
@@ -500,6 +2318,21 @@ Now that you have a dictionary for tokenization, you can tokenize your melodies
 
 
 
+def get_most_frequent_unit(dictionary):
+    """
+    Returns the first M2W unit of the most frequent token of a dictionary, used to check that features match.
+
+    Parameters:
+    - dictionary (dict or M2WDictionary): The dictionary.
+
+    Returns:
+    - str: The M2W unit.
+    """
+    if isinstance(dictionary, M2WDictionary):
+        return dictionary.most_frequent().split('_')[0]
+    return max(dictionary, key=dictionary.get).split('_')[0]
+
+
 def get_dictionary_by_occurrence(dictionary, dic_size, min_freq=10, max_length=10):
     """
     Create a dictionary based on token occurrence.
@@ -514,15 +2347,7 @@ def get_dictionary_by_occurrence(dictionary, dic_size, min_freq=10, max_length=1
     - dict: The generated dictionary based on token occurrence.
     """
 
-    sorted_vocs = sorted(dictionary.items(), key=lambda t: t[1], reverse=True)
-
-    vocs = {}
-    for idx, (word, count) in enumerate(sorted_vocs):
-        if len(word.split('_')) <= max_length and len(word.split('_')) > 1 and count > min_freq:
-            vocs[word] = count
-            if len(vocs) == dic_size:
-                break
-
+    vocs = select_frequent_tokens(dictionary, dic_size, min_freq, max_length)
 
     if dic_size > len(vocs):
         print('Dictionary size too large..Get full-size dictionary of..', len(vocs))
@@ -558,8 +2383,11 @@ def get_dictionary_by_length(dictionary, dic_size, min_freq=10, max_length=11):
     - dict: The built dictionary organized by length.
     """
     vocs = get_dictionary_by_occurrence(dictionary, dic_size, min_freq, max_length)
-    maxlen = max(len(i.split('_')) for i in vocs)
-    vocdic = {str(lth): [i for i in vocs if len(i.split('_')) == lth] for lth in range(maxlen, 1, -1)}
+    lengths = {i: i.count('_') + 1 for i in vocs}
+    maxlen = max(lengths.values())
+    vocdic = {str(lth): [] for lth in range(maxlen, 1, -1)}
+    for i in vocs:
+        vocdic[str(lengths[i])].append(i)
     return vocdic
 
 
@@ -626,22 +2454,185 @@ def tokenize_single_M2W_seq(dic, M2W):
     return M2Wtoken
 
 
-def get_M2W_tokens(M2W, dictionary, dic_size=100, feat=3):
+def build_token_trie(dic):
+    """
+    Builds a trie over the entries of a length-bucketed dictionary, to be compiled once and reused.
+
+    Parameters:
+    - dic (dict): A dictionary from `get_dictionary_by_length()`, where each key is a token length and each value
+                  is a list of tokens ordered by frequency.
+
+    Returns:
+    - dict: A nested dictionary keyed by M2W unit. The None key of a node holds the rank of the token ending there
+            (longer tokens first, then by frequency), which is the order `tokenize_single_M2W_seq()` matches them in.
+    """
+    trie = {}
+    rank = 0
+    for mlen in dic:
+        for voc in dic[mlen]:
+            node = trie
+            for unit in voc.split('_'):
+                node = node.setdefault(unit, {})
+            node.setdefault(None, rank)
+            rank += 1
+    return trie
+
+
+def tokenize_M2W_seq_with_trie(trie, M2W):
+    """
+    Tokenizes a list of M2W sequence(a single melody) based on a compiled dictionary trie.
+
+    All dictionary matches are found in a single left-to-right pass over the melody. They are then accepted in the
+    order of `tokenize_single_M2W_seq()` (longer tokens first, then more frequent tokens, then leftmost), skipping
+    matches that overlap an accepted one, so the result is the same as with `tokenize_single_M2W_seq()`.
+
+    Parameters:
+    - trie (dict): A trie from `build_token_trie()`.
+    - M2W (list): A list of M2W representations (strings) that are to be tokenized.
+
+    Returns:
+    - list: A list of tokenized M2W representations.
+    """
+    n = len(M2W)
+    matches = []
+    for start in range(n):
+        node = trie
+        for end in range(start, n):
+            node = node.get(M2W[end])
+            if node is None:
+                break
+            if None in node:
+                matches.append((node[None], start, end + 1))
+
+    if not matches:
+        print('Nothing to tokenize..(Check the dictionary feature properties.)')
+
+    matches.sort()
+    taken = bytearray(n)
+    span_end = {}
+    for _, start, end in matches:
+        if not any(taken[start:end]):
+            taken[start:end] = b'\x01' * (end - start)
+            span_end[start] = end
+
+    M2Wtoken = []
+    idx = 0
+    while idx < n:
+        end = span_end.get(idx, idx + 1)
+        M2Wtoken.append(('_').join(M2W[idx:end]))
+        idx = end
+    return M2Wtoken
+
+
+class M2WTokenizer:
+    """
+    A reusable tokenizer compiled once from a dictionary.
+
+    It holds the length-bucketed vocabulary of `get_dictionary_by_length()` and its trie, so single melodies can be
+    tokenized without re-sorting the dictionary on every call. It can be saved to a compact file and loaded again.
+
+    Parameters:
+    - dictionary (dict): The dictionary used for tokenization (token: frequency).
+    - dic_size (int): Desired dictionary size. Defaults to 100.
+    - min_freq (int): Minimum frequency threshold for tokenization. Defaults to 10.
+    - max_length (int): Maximum length of tokens for tokenization. Defaults to 11.
+    """
+
+    def __init__(self, dictionary, dic_size=100, min_freq=10, max_length=11):
+        self.dic_size = dic_size
+        self.min_freq = min_freq
+        self.max_length = max_length
+        # Most frequent M2W unit of the dictionary, used to check that features match
+        self.example = get_most_frequent_unit(dictionary)
+        self._compile(get_dictionary_by_length(dictionary, dic_size, min_freq, max_length))
+
+    def _compile(self, dic):
+        self.dic = dic
+        self.trie = build_token_trie(dic)
+
+    def __len__(self):
+        return sum(len(vocs) for vocs in self.dic.values())
+
+    def tokenize(self, seq):
+        """
+        Tokenizes a single M2W sequence.
+        """
+        return tokenize_M2W_seq_with_trie(self.trie, seq)
+
+    def tokenize_batch(self, seqs):
+        """
+        Tokenizes a list of M2W sequences.
+        """
+        return [tokenize_M2W_seq_with_trie(self.trie, seq) for seq in seqs]
+
+    def save(self, path):
+        """
+        Saves the tokenizer: the frequency-ordered token list of each length, joined in a single string, and the
+        compiled trie, so loading does not need to rebuild it.
+        """
+        state = {'dic_size': self.dic_size, 'min_freq': self.min_freq, 'max_length': self.max_length,
+                 'example': self.example,
+                 'lengths': [(mlen, len(vocs)) for mlen, vocs in self.dic.items()],
+                 'tokens': '\n'.join(voc for vocs in self.dic.values() for voc in vocs),
+                 'trie': self.trie}
+        with open(path, 'wb') as handle:
+            pickle.dump(state, handle, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads a tokenizer saved with `save()`.
+        """
+        # The trie holds many small dicts; pausing the garbage collector makes unpickling several times faster
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            with open(path, 'rb') as handle:
+                state = pickle.load(handle)
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+        tokenizer = cls.__new__(cls)
+        tokenizer.dic_size = state['dic_size']
+        tokenizer.min_freq = state['min_freq']
+        tokenizer.max_length = state['max_length']
+        tokenizer.example = state['example']
+
+        tokens = state['tokens'].split('\n') if state['tokens'] else []
+        tokenizer.dic = {}
+        pos = 0
+        for mlen, count in state['lengths']:
+            tokenizer.dic[mlen] = tokens[pos:pos + count]
+            pos += count
+        tokenizer.trie = state['trie']
+        return tokenizer
+
+
+def get_M2W_tokens(M2W, dictionary, dic_size=100, feat=3, engine='trie'):
     """
     Tokenizes Mel2Word data using a given dictionary.
 
     Parameters:
     - M2W (list): List of M2W representations to be tokenized.
-    - dictionary (dict): The dictionary used for tokenization.
+    - dictionary (dict or M2WTokenizer): The dictionary used for tokenization, or a compiled tokenizer (then dic_size is ignored).
     - dic_size (int, optional): The size of the dictionary to be used. Defaults to 100.
     - feat (int, optional): The feature type (1 for 'pitch', 2 for 'rhythm', 3 for 'all'). Defaults to 3.
+    - engine (str, optional): 'trie' uses `tokenize_M2W_seq_with_trie()`; 'scan' uses `tokenize_single_M2W_seq()`.
+      Both give the same tokens. Defaults to 'trie'.
 
     Returns:
     - list: The tokenized Mel2Word data.
     """
+    if engine not in ('trie', 'scan'):
+        raise ValueError(f"Unknown tokenization engine '{engine}'. Use 'trie' or 'scan'.")
+
     feat_str = None
 
-    M2Wk = max(dictionary, key=dictionary.get).split('_')[0]
+    if isinstance(dictionary, M2WTokenizer):
+        M2Wk = dictionary.example
+    else:
+        M2Wk = get_most_frequent_unit(dictionary)
 
     print('M2W for Data Example:',M2W[0])
     print('M2W for Dictionary Example:',M2Wk)
@@ -664,8 +2655,13 @@ def get_M2W_tokens(M2W, dictionary, dic_size=100, feat=3):
         elif feat_str == 'rhythm':
             print('Tokenization for Rhythm Feature..')
 
+        if isinstance(dictionary, M2WTokenizer):
+            return dictionary.tokenize(M2W)
+
         dic = get_dictionary_by_length(dictionary, dic_size)
 
+        if engine == 'trie':
+            return tokenize_M2W_seq_with_trie(build_token_trie(dic), M2W)
         return tokenize_single_M2W_seq(dic, M2W)
 
     else:
@@ -679,27 +2675,60 @@ def get_M2W_tokens(M2W, dictionary, dic_size=100, feat=3):
         return None
 
 
-def get_M2W_tokenized_dataset(data, dictionary, feat=3, dic_size=100, min_num=10, max_length=11):
+# Matcher of the current tokenization worker: ('trie', trie) or ('scan', length-bucketed dictionary)
+_tokenize_worker_matcher = None
+
+
+def _init_tokenize_worker(matcher):
+    """
+    Stores the prepared dictionary in a tokenization worker, once for all songs it handles.
+    """
+    global _tokenize_worker_matcher
+    _tokenize_worker_matcher = matcher
+
+
+def _tokenize_in_worker(M2W):
+    """
+    Tokenizes a single M2W sequence with the matcher of the current worker.
+    """
+    engine, matcher = _tokenize_worker_matcher
+    if engine == 'trie':
+        return tokenize_M2W_seq_with_trie(matcher, M2W)
+    return tokenize_single_M2W_seq(matcher, M2W)
+
+
+def get_M2W_tokenized_dataset(data, dictionary, feat=3, dic_size=100, min_num=10, max_length=11, engine='trie',
+                              n_jobs=1, chunksize=64):
     """
     Tokenize Mel2Word representations in a dataset using a custom dictionary.
 
     Parameters:
     - data (list of dicts): List of dictionaries containing Mel2Word representations.
-    - dictionary (dict): Custom dictionary for tokenization.
+    - dictionary (dict or M2WTokenizer): Custom dictionary for tokenization, or a compiled tokenizer (then dic_size, min_num and max_length are ignored).
     - feat (int): Feature option for tokenization (1 for pitch, 2 for rhythm, 3 for both).
     - dic_size (int): Desired dictionary size.
     - min_num (int): Minimum frequency threshold for tokenization.
     - max_length (int): Maximum length of tokens for tokenization.
+    - engine (str): 'trie' compiles the dictionary into a trie once for the whole dataset; 'scan' uses `tokenize_single_M2W_seq()`.
+    - n_jobs (int): Number of worker processes; 1 tokenizes serially, None uses all CPU cores.
+    - chunksize (int): Number of songs sent to a worker at a time when n_jobs > 1.
 
     Returns:
     - list of dicts: Updated dataset with tokenized Mel2Word representations.
     """
+    if engine not in ('trie', 'scan'):
+        raise ValueError(f"Unknown tokenization engine '{engine}'. Use 'trie' or 'scan'.")
+
     print('Processing M2W tokenization for dataset for feature:', ['M2W_pitch' if feat == 1 else 'M2W_rhythm' if feat == 2 else 'M2W_all'])
 
 
     # Generate a custom dictionary based on length
-    dic = get_dictionary_by_length(dictionary, dic_size, min_num, max_length)
-    M2Wk = max(dictionary, key=dictionary.get).split('_')[0]
+    if isinstance(dictionary, M2WTokenizer):
+        dic = dictionary.dic
+        M2Wk = dictionary.example
+    else:
+        dic = get_dictionary_by_length(dictionary, dic_size, min_num, max_length)
+        M2Wk = get_most_frequent_unit(dictionary)
     M2W = data[0]['M2W_pitch' if feat == 1 else 'M2W_rhythm' if feat == 2 else 'M2W_all']
     print('M2W for Data Example:',M2W[0])
     print('M2W for Dictionary Example:',M2Wk)
@@ -714,17 +2743,35 @@ def get_M2W_tokenized_dataset(data, dictionary, feat=3, dic_size=100, min_num=10
         return None
 
     if feat_str is not None:
+      if isinstance(dictionary, M2WTokenizer):
+          trie = dictionary.trie
+      else:
+          trie = build_token_trie(dic) if engine == 'trie' else None
 
-      # Iterate through each song in the dataset
-      for sidx, song in enumerate(data):
-          M2W = song['M2W_pitch' if feat == 1 else 'M2W_rhythm' if feat == 2 else 'M2W_all']
-
-          M2W_tokenized = tokenize_single_M2W_seq(dic, M2W)
-
-          song['token_pitch' if feat == 1 else 'token_rhythm' if feat == 2 else 'token_all'] = M2W_tokenized
+      feat_key = 'M2W_pitch' if feat == 1 else 'M2W_rhythm' if feat == 2 else 'M2W_all'
+      token_key = 'token_pitch' if feat == 1 else 'token_rhythm' if feat == 2 else 'token_all'
+      matcher = ('trie', trie) if trie is not None else ('scan', dic)
 
-          if sidx % 100 == 0:
-              print('Tokenization done for', song['f_name'], sidx + 1, '/', len(data))
+      if n_jobs == 1:
+          _init_tokenize_worker(matcher)
+          results = map(_tokenize_in_worker, (song[feat_key] for song in data))
+          executor = None
+      else:
+          # The prepared dictionary is sent once per worker; results come back in song order
+          executor = ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_tokenize_worker, initargs=(matcher,))
+          results = executor.map(_tokenize_in_worker, [song[feat_key] for song in data], chunksize=chunksize)
+
+      try:
+          # Iterate through each song in the dataset
+          for sidx, (song, M2W_tokenized) in enumerate(zip(data, results)):
+              song[token_key] = M2W_tokenized
+
+              if sidx % 100 == 0:
+                  print('Tokenization done for', song['f_name'], sidx + 1, '/', len(data))
+      finally:
+          _init_tokenize_worker(None)
+          if executor is not None:
+              executor.shutdown()
     else:
       print("ERROR!!!!!!!!!!:Check if the features of the dictionary match the specified feature...")
 
@@ -736,21 +2783,254 @@ def get_M2W_tokenized_dataset(data, dictionary, feat=3, dic_size=100, min_num=10
 
     return data
 
+def iter_M2W_tokenized_dataset(data, tokenizer, feat=3):
+    """
+    Lazily tokenizes the songs of a dataset, one song at a time.
+
+    Parameters:
+    - data (iterable of dicts): Songs containing Mel2Word representations (a list, an M2WCorpus or a generator).
+    - tokenizer (M2WTokenizer): The compiled tokenizer.
+    - feat (int): Feature option for tokenization (1 for pitch, 2 for rhythm, 3 for both).
+
+    Yields:
+    - dict: The song with its 'token_pitch', 'token_rhythm' or 'token_all' sequence added.
+    """
+    feat_key = 'M2W_pitch' if feat == 1 else 'M2W_rhythm' if feat == 2 else 'M2W_all'
+    token_key = 'token_pitch' if feat == 1 else 'token_rhythm' if feat == 2 else 'token_all'
+
+    for song in data:
+        song[token_key] = tokenizer.tokenize(song[feat_key])
+        yield song
+
+
+def count_M2W_tokens(data, feat, min_length=1):
+    """
+    Counts the tokens of a feature over a dataset in a single streaming pass.
+
+    Parameters:
+    - data (iterable of dicts): Songs containing the feature (a list, an M2WCorpus, an M2WColumnarDataset, a
+      generator, or a function returning an iterator of dicts); read through `M2WFeatureView`.
+    - feat (str): The key of the feature to count ('M2W_pitch', 'token_all', ...).
+    - min_length (int, optional): Only count tokens made of at least this many M2W units. Defaults to 1.
+
+    Returns:
+    - Counter: The token frequencies.
+    """
+    counts = Counter()
+    for seq in M2WFeatureView(data, feat):
+        if min_length > 1:
+            counts.update(token for token in seq if token.count('_') + 1 >= min_length)
+        else:
+            counts.update(seq)
+    return counts
+
+
+class M2WIndex:
+    """
+    An inverted index over one feature ('M2W_*' or 'token_*') of a corpus, for melodic pattern search.
+
+    Every token and every n-gram of `ngram` tokens has a postings list of the (song, position) pairs it occurs at,
+    stored as one int64 key per occurrence (song << 32 | position) in the order the songs were added. A phrase is
+    looked up by intersecting the postings of the n-grams (or tokens, for phrases shorter than `ngram`) covering it,
+    shifted by their offset in the phrase. Songs can be added at any time, and the index can be saved and loaded.
+
+    Parameters:
+    - feat (str, optional): The feature to index. Defaults to 'M2W_all'.
+    - ngram (int, optional): The n-gram length indexed besides single tokens. Defaults to 3.
+    """
+
+    def __init__(self, feat='M2W_all', ngram=3):
+        self.feat = feat
+        self.ngram = ngram
+        self.names = []  # song index -> file name
+        self.lengths = array('i')  # song index -> number of tokens
+        self.postings = {}  # token (str) or n-gram (tuple) -> array('q') of song << 32 | position
+        self._norms = None
+
+    def __len__(self):
+        return len(self.names)
+
+    def _gram_sizes(self):
+        return (1,) if self.ngram <= 1 else (1, self.ngram)
+
+    def add(self, data):
+        """
+        Adds the songs of a dataset (a list of dicts, an M2WCorpus, an M2WColumnarDataset, ...) to the index.
+
+        Returns:
+        - range: The indices of the added songs.
+        """
+        start = len(self)
+        for song in data:
+            self.add_song(song[self.feat], song.get('f_name'))
+        return range(start, len(self))
+
+    def add_song(self, seq, name=None):
+        """
+        Adds one token sequence to the index.
+
+        Returns:
+        - int: The index of the song.
+        """
+        song_idx = len(self.names)
+        self.names.append(name if name is not None else str(song_idx))
+        self.lengths.append(len(seq))
+        base = song_idx << 32
+        for n in self._gram_sizes():
+            for pos in range(len(seq) - n + 1):
+                key = seq[pos] if n == 1 else tuple(seq[pos:pos + n])
+                postings = self.postings.get(key)
+                if postings is None:
+                    postings = self.postings[key] = array('q')
+                postings.append(base | pos)
+        self._norms = None
+        return song_idx
+
+    def _keys(self, key):
+        postings = self.postings.get(key)
+        return None if postings is None else np.frombuffer(postings, dtype=np.int64)
+
+    def find(self, phrase):
+        """
+        Finds the exact occurrences of a phrase.
+
+        Parameters:
+        - phrase (list or str): The tokens of the phrase. A string is split into M2W units for 'M2W_*' features
+          (e.g. 'U02050_D01100') and taken as a single token for 'token_*' features.
+
+        Returns:
+        - list: (song index, position) of each occurrence, in song order; the file names are in `names`.
+        """
+        if isinstance(phrase, str):
+            phrase = phrase.split('_') if self.feat.startswith('M2W') else [phrase]
+        phrase = list(phrase)
+        if not phrase:
+            return []
+
+        # Cover the phrase with n-grams (the last one aligned to the end), or with single tokens if it is short
+        n = self.ngram if self.ngram > 1 and len(phrase) >= self.ngram else 1
+        starts = list(range(0, len(phrase) - n + 1, n))
+        if starts[-1] != len(phrase) - n:
+            starts.append(len(phrase) - n)
+
+        parts = []
+        for off in starts:
+            keys = self._keys(phrase[off] if n == 1 else tuple(phrase[off:off + n]))
+            if keys is None:
+                return []
+            parts.append((len(keys), off, keys))
+
+        hits = None
+        for _, off, keys in sorted(parts, key=lambda part: part[0]):  # rarest first
+            keys = keys - off
+            hits = keys if hits is None else np.intersect1d(hits, keys, assume_unique=True)
+            if not hits.size:
+                return []
+
+        return [(int(key >> 32), int(key & 0xFFFFFFFF)) for key in hits]
+
+    def _song_counts(self, token):
+        # Songs containing a token and its count in each of them
+        return np.unique(self._keys(token) >> 32, return_counts=True)
+
+    def _idf(self, df):
+        return np.log((len(self) + 1) / (df + 1)) + 1
+
+    def similar(self, seq, k=10):
+        """
+        Finds the songs most similar to a token sequence, by TF-IDF cosine similarity of their tokens.
+
+        Parameters:
+        - seq (list): The tokens of the query melody (e.g. another song's 'token_all').
+        - k (int, optional): The number of songs to return. Defaults to 10.
+
+        Returns:
+        - list: (song index, similarity) of the `k` most similar songs, most similar first.
+        """
+        if not len(self):
+            return []
+
+        if self._norms is None:
+            # Norms of the TF-IDF vectors of the songs, recomputed after songs are added
+            norms = np.zeros(len(self))
+            for token in self.postings:
+                if isinstance(token, str):
+                    songs, counts = self._song_counts(token)
+                    np.add.at(norms, songs, (counts * self._idf(len(songs))) ** 2)
+            self._norms = np.sqrt(norms)
+
+        scores = np.zeros(len(self))
+        query_norm = 0.0
+        for token, query_count in Counter(seq).items():
+            if token not in self.postings:
+                continue
+            songs, counts = self._song_counts(token)
+            idf = self._idf(len(songs))
+            scores[songs] += query_count * counts * idf ** 2
+            query_norm += (query_count * idf) ** 2
+        if query_norm == 0:
+            return []
+
+        scores /= np.sqrt(query_norm) * np.where(self._norms > 0, self._norms, 1)
+        top = np.flatnonzero(scores > 0)
+        top = top[np.lexsort((top, -scores[top]))][:k]
+        return [(int(song_idx), float(scores[song_idx])) for song_idx in top]
+
+    def save(self, path):
+        """
+        Saves the index; it can be loaded with `M2WIndex.load()` and extended with more songs.
+        """
+        state = {'feat': self.feat, 'ngram': self.ngram, 'names': self.names, 'lengths': self.lengths.tobytes(),
+                 'postings': {key: postings.tobytes() for key, postings in self.postings.items()}}
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as handle:
+            pickle.dump(state, handle, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads an index saved with `save()`.
+        """
+        # The postings are many small objects; pausing the garbage collector makes unpickling faster
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            with open(path, 'rb') as handle:
+                state = pickle.load(handle)
+            index = cls(state['feat'], state['ngram'])
+            index.names = state['names']
+            index.lengths.frombytes(state['lengths'])
+            for key, postings in state['postings'].items():
+                index.postings[key] = array('q')
+                index.postings[key].frombytes(postings)
+        finally:
+            if gc_enabled:
+                gc.enable()
+        return index
+
+
 """### Tokenization for a Single MIDI File
 
 You can tokenize individual melodies that have been converted to Mel2Word (M2W) representations into M2W vocabularies using the `get_M2W_tokens()` function. To extract M2W features from MIDI, you can refer to the `get_M2W_from_midipath()` function above.
 
+When tokenizing many melodies one at a time (e.g. in a service), build an `M2WTokenizer` once from the dictionary and call its `tokenize()` or `tokenize_batch()` methods. It can be stored with `save()` and restored with `M2WTokenizer.load()`, and it can also be passed to `get_M2W_tokens()` and `get_M2W_tokenized_dataset()` in place of the dictionary.
+
 ### Tokenization for Multiple MIDI Data
 
 You can tokenize the entire dataset using the `get_M2W_tokens_for_dataset` function. To do this, provide the M2W-processed dataset and the generated dictionary. To convert the entire dataset to M2W representations using a data folder path, you can refer to the `get_M2W_dataset()` function mentioned earlier.
 
 Notice that the data is in list format, with tokenized melodies stored under keys like 'token_pitch,' 'token_rhythm,' or 'token_all' based on the feature (pitch, rhythm, or all).
 
+### Searching Melodic Patterns
+
+An `M2WIndex` indexes one feature of a converted or tokenized dataset (`index = M2WIndex('M2W_all'); index.add(data)`). `index.find('U02050_D01100_E00100')` lists the songs and positions where a phrase occurs, and `index.similar(song['token_all'], k=10)` finds the songs sharing the most tokens with a melody. The index can be saved, loaded and extended with new songs.
+
 ##Usage
 
 This approach offers the advantage of enabling the direct application of existing NLP algorithms to string-format melodies. To illustrate this, let's explore two examples:
 
-1. Visualizing Word Importance with a WordCloud: We can utilize word frequency to visualize the importance of words in a WordCloud.
+1. Visualizing Word Importance with a WordCloud: We can utilize word frequency to visualize the importance of words in a WordCloud. The frequencies are counted in one pass over the data (`get_M2W_token_frequencies()`); for huge corpora, `max_tokens` keeps the counting in bounded memory with approximate frequencies.
 
 2. Creating Distribution Representations of Word Contexts using Word2Vec: We can employ the Word2Vec approach to generate distribution representations of word contexts.
 
@@ -773,132 +3053,311 @@ You can choose to use your own custom tokenized data or utilize the pre-tokenize
 
 # @title Code for WordCloud
 
-# Import necessary libraries
-from wordcloud import WordCloud
-import matplotlib.pyplot as plt
+def get_M2W_token_frequencies(data, feat, min_length=2, max_tokens=None):
+    """
+    Computes the token frequencies of a feature in a single streaming pass, for word clouds and similar uses.
+
+    Parameters:
+    - data (iterable of dicts): Songs containing the feature (a list, an M2WCorpus, an M2WColumnarDataset, a
+      function returning an iterator of dicts, ...).
+    - feat (str): The key of the feature to count ('M2W_pitch', 'token_all', ...).
+    - min_length (int, optional): Only count tokens made of at least this many M2W units; the default of 2 leaves
+      out single M2W units (morphemes). Defaults to 2.
+    - max_tokens (int, optional): If given, approximate the counts with at most `2 * max_tokens` distinct tokens in
+      memory (Misra-Gries): whenever the table grows beyond that, the (max_tokens + 1)-th largest count is taken off
+      every entry and the entries that drop to zero are removed. Any token more frequent than total / max_tokens is
+      kept, and each count is underestimated by at most total / max_tokens. Defaults to None (exact counts).
+
+    Returns:
+    - Counter: The token frequencies.
+    """
+    if max_tokens is None:
+        return count_M2W_tokens(data, feat, min_length)
+
+    counts = Counter()
+    for seq in M2WFeatureView(data, feat):
+        if min_length > 1:
+            counts.update(token for token in seq if token.count('_') + 1 >= min_length)
+        else:
+            counts.update(seq)
 
-def Get_WordCloud_for_M2W(data, feat):
+        if len(counts) > 2 * max_tokens:
+            values = np.fromiter(counts.values(), dtype=np.int64, count=len(counts))
+            decrement = int(np.partition(values, len(values) - max_tokens - 1)[len(values) - max_tokens - 1])
+            counts = Counter({token: count - decrement for token, count in counts.items() if count > decrement})
+
+    return counts
+
+
+def Get_WordCloud_for_M2W(data, feat, max_tokens=None):
     """
-    Generate a Word Cloud for a specific feature (M2W_pitch, M2W_all, etc.) in the given dataset.
+    Generate a Word Cloud for a specific feature (M2W_pitch, M2W_rhythm, M2W_all, etc.) in the given dataset.
+
+    The token frequencies are counted in one streaming pass with `get_M2W_token_frequencies()` and the cloud is drawn
+    from them, so the dataset is not copied or joined into text, and numeric (rhythm) tokens work as well. Single
+    M2W units are left out of tokenized features ('token_*').
 
     Args:
-        data (list): List of dictionaries containing song data.
+        data (list): List of dictionaries containing song data (or any dataset accepted by `get_M2W_token_frequencies()`).
         feat (str): The feature to visualize using a Word Cloud.
+        max_tokens (int, optional): Approximate the frequencies in bounded memory for huge corpora (see
+            `get_M2W_token_frequencies()`). Defaults to None (exact counts).
 
     Returns:
         None
     """
-    # Check if the feature is 'M2W_rhythm'
-    if feat == 'M2W_rhythm':
-        print("Error!!: The current WordCloud implementation struggles to handle text consisting solely of numbers.")
-        print("Please consider using a different feature for analysis.")
-    else:
-        # Extract the specified feature from the dataset
-        feature_data = [song[feat] for song in data]
-        filtered_data = [[element for element in sublist if len(element.split('_')) > 1] for sublist in feature_data] #removing morphemes
-
-        # Flatten the list of feature data into a single string
-        all_text = ' '.join([' '.join(song_text) for song_text in filtered_data])
-
-        # Create a WordCloud object
-        wordcloud = WordCloud(width=300, height=200, background_color='white').generate(all_text)
-
-        # Display the Word Cloud
-        plt.figure(figsize=(7, 4))
-        plt.imshow(wordcloud, interpolation='bilinear')
-        plt.title(f'Word Cloud for {feat.upper()}')
-        plt.axis('off')
-        plt.show()
+    # Count the tokens of the feature, removing morphemes (the 'M2W_*' features only have morphemes, so keep them)
+    min_length = 1 if feat.startswith('M2W') else 2
+    frequencies = get_M2W_token_frequencies(data, feat, min_length=min_length, max_tokens=max_tokens)
+    if not frequencies:
+        print("Error!!: No tokens were found for", feat)
+        return
+
+    from wordcloud import WordCloud
+    import matplotlib.pyplot as plt
+
+    # Create a WordCloud object
+    wordcloud = WordCloud(width=300, height=200, background_color='white').generate_from_frequencies(frequencies)
+
+    # Display the Word Cloud
+    plt.figure(figsize=(7, 4))
+    plt.imshow(wordcloud, interpolation='bilinear')
+    plt.title(f'Word Cloud for {feat.upper()}')
+    plt.axis('off')
+    plt.show()
 
 # @title Code for Word2Vec
 
-from sklearn.manifold import TSNE
-import matplotlib.pyplot as plt
-import numpy as np
+def _feature_fingerprint(feature_data):
+    # Content hash of a feature of a dataset, streamed one song at a time
+    digest = hashlib.sha256()
+    for seq in feature_data:
+        digest.update(' '.join(seq).encode('utf-8') + b'\n')
+    return digest.hexdigest()
 
-def create_word2vec_model_for_M2W(data, feat, vector_size=100, window=5, min_count=1, epochs=300):
+
+def create_word2vec_model_for_M2W(data, feat, vector_size=100, window=5, min_count=1, epochs=300, workers=3,
+                                  cache_dir=None, **kwargs):
     """
     Create a Word2Vec model for a specific feature in the data.
 
     Parameters:
-    data (list of dict): List of data points where each dict contains the specified feature.
+    data (list of dict, M2WCorpus, M2WColumnarDataset, str or callable): Data points where each dict contains the
+        specified feature. Any re-iterable of dicts is streamed without building a list of the feature sequences; a
+        str is loaded with `load_dataset()` (columnar datasets are read lazily), and a function returning an
+        iterator of dicts (e.g. a generator function) is called again for every pass over the data. A one-shot
+        iterator (e.g. a generator object) is collected into a list of the feature sequences first.
     feat (str): The key of the feature to create Word2Vec embeddings for.
     vector_size (int): Dimensionality of the word vectors.
     window (int): Maximum distance between the current and predicted word within a sentence.
     min_count (int): Ignores all words with a total frequency lower than this.
     epochs (int): Number of iterations over the dataset.
+    workers (int): Number of worker threads used for training.
+    cache_dir (str, optional): A directory of trained models. A model is reused when the feature sequences and the
+        hyperparameters (except `workers`) are the same; otherwise it is trained and stored there.
+    **kwargs: Other `gensim.models.Word2Vec` parameters (sg, negative, seed, ...).
 
     Returns:
     Word2Vec: Word2Vec model trained on the specified feature.
     """
-    # Extract the feature data
-    feature_data = [song[feat] for song in data]
+    if isinstance(data, str):
+        data = load_dataset(data)
+
+    if _is_one_shot_iterator(data):
+        # Word2Vec makes several passes over the data, so a one-shot iterator is collected into a list
+        feature_data = [d[feat] for d in data]
+    else:
+        # Stream the feature data
+        feature_data = M2WFeatureView(data, feat)
+
+    from gensim.models import Word2Vec
+
+    model_path = None
+    if cache_dir is not None:
+        params = {'feat': feat, 'vector_size': vector_size, 'window': window, 'min_count': min_count,
+                  'epochs': epochs, **kwargs}
+        key = hashlib.sha256((_feature_fingerprint(feature_data) + repr(sorted(params.items()))).encode()).hexdigest()
+        model_path = join(cache_dir, f'word2vec_{key[:16]}.model')
+        if os.path.exists(model_path):
+            print('Loading the cached Word2Vec model..', model_path)
+            return Word2Vec.load(model_path)
 
     # Train a Word2Vec model
-    model = Word2Vec(feature_data, vector_size=vector_size, window=window, min_count=min_count, epochs=epochs)
+    model = Word2Vec(feature_data, vector_size=vector_size, window=window, min_count=min_count, epochs=epochs,
+                     workers=workers, **kwargs)
+
+    if model_path is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        model.save(model_path)
+        print('Word2Vec model cached to..', model_path)
 
     return model
 
 
-def get_word2vec_visualization(model, num_top_words):
+_PROJECTION_CACHE = {}  # projection key -> 2-D coordinates, for the last few projections
+_PROJECTION_CACHE_SIZE = 8
+
+
+def get_word2vec_projection(model, num_top_words, method='tsne', perplexity=10, pca_components=None, random_state=42,
+                            cache_dir=None):
     """
-    Visualize word embeddings using t-SNE for the top N words in the model's vocabulary.
+    Projects the vectors of the top N words of a Word2Vec model to 2-D.
+
+    The projections are cached in memory (and in `cache_dir` if given), keyed by the words and vectors of the model,
+    N and the projection settings, so drawing the same model again does not recompute them.
 
     Parameters:
     model (Word2Vec): The Word2Vec model.
-    num_top_words (int): Number of top words to visualize.
+    num_top_words (int): Number of top words to project.
+    method (str): 'tsne' runs Barnes-Hut t-SNE on the word vectors; 'pca' projects on the first two principal
+        components, which is much faster for large vocabularies.
+    perplexity (float): The t-SNE perplexity (lowered to fit small numbers of words, down to 1).
+    pca_components (int, optional): If given, the centered vectors are first reduced with PCA to this many dimensions
+        before t-SNE, which speeds it up on large vocabularies but changes the layout. Defaults to None (t-SNE on the
+        vectors as they are).
+    random_state (int): Random seed of t-SNE.
+    cache_dir (str, optional): A directory to store the projections in.
 
     Returns:
-    None (displays a plot).
+    tuple: The projected words and their 2-D coordinates (array of shape (N, 2)).
     """
+    if method not in ('tsne', 'pca'):
+        raise ValueError(f"Unknown projection method '{method}'. Use 'tsne' or 'pca'.")
+
     # Get the top N words by frequency
     top_words = model.wv.index_to_key[:num_top_words]
+    if method == 'tsne' and len(top_words) < 2:
+        raise ValueError(f't-SNE needs at least 2 words, got {len(top_words)}; increase num_top_words.')
 
     # Extract word vectors for the top words
-    word_vectors = np.array([model.wv[word] for word in top_words])
+    word_vectors = model.wv.vectors[[model.wv.key_to_index[word] for word in top_words]]
+
+    digest = hashlib.sha256('\n'.join(top_words).encode('utf-8'))
+    digest.update(word_vectors.tobytes())
+    digest.update(repr((method, perplexity, pca_components, random_state)).encode())
+    key = digest.hexdigest()[:16]
+
+    if key in _PROJECTION_CACHE:
+        return top_words, _PROJECTION_CACHE[key]
+    cache_path = join(cache_dir, f'projection_{key}.npy') if cache_dir is not None else None
+    if cache_path is not None and os.path.exists(cache_path):
+        word_vectors_2d = np.load(cache_path)
+    else:
+        n_components = 2 if method == 'pca' else pca_components
+        if n_components is not None:
+            # Center the vectors and reduce them with PCA (via SVD)
+            reduced = word_vectors.astype(np.float64) - word_vectors.mean(axis=0, dtype=np.float64)
+            if n_components < min(reduced.shape):
+                _, _, components = np.linalg.svd(reduced, full_matrices=False)
+                reduced = reduced @ components[:n_components].T
+        else:
+            reduced = word_vectors
+
+        if method == 'pca':
+            word_vectors_2d = reduced[:, :2]
+        else:
+            from sklearn.manifold import TSNE
+
+            # Apply Barnes-Hut t-SNE for dimensionality reduction
+            tsne = TSNE(n_components=2, perplexity=max(1, min(perplexity, len(top_words) - 1)),
+                        random_state=random_state, method='barnes_hut')
+            word_vectors_2d = tsne.fit_transform(reduced)
+
+        if cache_path is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            np.save(cache_path, word_vectors_2d)
+
+    if len(_PROJECTION_CACHE) >= _PROJECTION_CACHE_SIZE:
+        del _PROJECTION_CACHE[next(iter(_PROJECTION_CACHE))]
+    _PROJECTION_CACHE[key] = word_vectors_2d
+    return top_words, word_vectors_2d
+
+
+def _thin_labels(points, max_labels):
+    """
+    Picks at most `max_labels` points to label, at most one per cell of a grid over the plot, preferring the first
+    (most frequent) point of each cell.
+    """
+    if len(points) <= max_labels:
+        return np.arange(len(points))
+    grid = max(1, int(2 * math.sqrt(max_labels)))
+    span = np.ptp(points, axis=0)
+    cells = np.floor((points - points.min(axis=0)) / np.where(span > 0, span, 1) * (grid - 1e-9)).astype(np.int64)
+    _, first = np.unique(cells[:, 0] * grid + cells[:, 1], return_index=True)
+    return np.sort(first)[:max_labels]
+
+
+def get_word2vec_visualization(model, num_top_words, method='tsne', perplexity=10, pca_components=None, max_labels=200,
+                               cache_dir=None):
+    """
+    Visualize word embeddings using t-SNE (or PCA) for the top N words in the model's vocabulary.
+
+    All words are drawn in a single scatter plot. When there are more than `max_labels` words, only some are
+    labelled: the most frequent word in each cell of a grid over the plot, so labels do not pile up.
+
+    Parameters:
+    model (Word2Vec): The Word2Vec model.
+    num_top_words (int): Number of top words to visualize.
+    method (str): 'tsne' or 'pca'; see `get_word2vec_projection()`.
+    perplexity (float): The t-SNE perplexity.
+    pca_components (int, optional): Dimensions kept by an optional PCA pre-reduction before t-SNE (e.g. 50 for large
+        vocabularies); see `get_word2vec_projection()`. Defaults to None.
+    max_labels (int): The maximum number of word labels; None labels every word.
+    cache_dir (str, optional): A directory to store the projections in.
+
+    Returns:
+    None (displays a plot).
+    """
+    top_words, word_vectors_2d = get_word2vec_projection(model, num_top_words, method, perplexity, pca_components,
+                                                         cache_dir=cache_dir)
 
-    # Apply t-SNE for dimensionality reduction
-    tsne = TSNE(n_components=2, perplexity=10, random_state=42)
-    word_vectors_2d = tsne.fit_transform(word_vectors)
+    import matplotlib.pyplot as plt
 
     # Visualize the word vectors
     plt.figure(figsize=(8, 6))
-    for i, word in enumerate(top_words):
+    plt.scatter(word_vectors_2d[:, 0], word_vectors_2d[:, 1], s=10 if len(top_words) > 1000 else None,
+                c=np.arange(len(top_words)) % 10, cmap='tab10')
+
+    labelled = np.arange(len(top_words)) if max_labels is None else _thin_labels(word_vectors_2d, max_labels)
+    for i in labelled:
         x, y = word_vectors_2d[i]
-        plt.scatter(x, y)
-        plt.annotate(word, xy=(x, y), xytext=(5, 2), textcoords='offset points', ha='right', va='bottom', fontsize=8)
+        plt.annotate(top_words[i], xy=(x, y), xytext=(5, 2), textcoords='offset points', ha='right', va='bottom', fontsize=8)
 
+    dimension = 't-SNE' if method == 'tsne' else 'PCA'
     plt.title(f"Word2Vec Word Embeddings Visualization (Top {num_top_words} Words)")
-    plt.xlabel("t-SNE Dimension 1")
-    plt.ylabel("t-SNE Dimension 2")
+    plt.xlabel(f"{dimension} Dimension 1")
+    plt.ylabel(f"{dimension} Dimension 2")
     plt.show()
 
 """Generate Word2Vec embeddings for your chosen feature by specifying the 'feat' key.
 
 With this Word2Vec model, you can perform various tasks with your trained Word2Vec model. Here are some simple tasks you can do.
 
+The data is streamed to Word2Vec, so it can also be a columnar dataset file, an `M2WCorpus` or a generator function. Pass `cache_dir='w2v_models'` to reuse a model trained earlier on the same data with the same hyperparameters.
+
+For large vocabularies, `get_word2vec_visualization(model, 20000, method='pca')` projects the vectors much faster than t-SNE; to keep t-SNE, `pca_components=50` reduces the vectors first, which speeds it up but changes the layout. Every word is drawn in one scatter plot, and only up to `max_labels` labels are spread over the plot. Pass `cache_dir` to keep the projections on disk.
+
 ## Reconstructing Mel2Word to MIDI
 
 You can use the `Mel2midi` function to convert Mel2Word-encoded melodies into MIDI files, allowing playback and editing in standard music software. Simply provide a list of melodies encoded as 'M2W_all' or 'token_all' feature, which includes both pitch and rhythm information, and specify the desired file name for saving the MIDI file.
+
+`Mel2midi(..., engine='direct')` writes the same file without music21. To render many melodies at once, use `Mel2midi_batch(M2WFeatureView(data, 'token_all'), 'midi_out', n_jobs=4)`, or leave out the directory to get the MIDI bytes in memory.
 """
 
 # @title Code for MIDI Generation from Mel2Word
 
-def Mel2midi(song,file_path, first_pitch = 69, last_beat=4):
+def decode_M2W_song(song, first_pitch=69, last_beat=4):
     """
-    Converts a Mel2Word encoded melody into a MIDI file.
+    Decodes a Mel2Word encoded melody into absolute pitches and note durations.
 
     Parameters:
-    - song (list): List of Mel2Word encoded tokens.
-    - file_path (str): Path to save the MIDI file.
+    - song (list): List of Mel2Word encoded tokens ('M2W_all' units or 'token_all' tokens).
     - first_pitch (int): The pitch value for the first note (default is MIDI note 69, middle A).
-    - first_beat (int): The beat value for the first note (default is 1).
     - last_beat (int): The beat value for the last note (default is 4).
 
     Returns:
-    None
+    - tuple: The MIDI pitches and the durations in quarter notes of the notes.
     """
-
     formidi=[]
     for i, tok in enumerate(song):
         tmp=tok.split('_')
@@ -925,6 +3384,87 @@ def Mel2midi(song,file_path, first_pitch = 69, last_beat=4):
         get_beat.append(note_beat)
     get_beat.append(last_beat)
 
+    return get_pitch, get_beat
+
+
+def _write_varlen(value):
+    """
+    Encodes a MIDI variable-length quantity.
+    """
+    out = [value & 0x7F]
+    value >>= 7
+    while value:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    return bytes(reversed(out))
+
+
+def write_midi_bytes(pitches, durations, ticks_per_quarter=10080, velocity=90):
+    """
+    Writes a monophonic melody as Standard MIDI File bytes, without building any music21 objects.
+
+    The file has the layout `Mel2midi()` gets from music21's `streamToMidiFile()`: format 1, a conductor track
+    (120 BPM, 4/4) and one track with the notes played one after another on channel 1.
+
+    Parameters:
+    - pitches (list): MIDI pitches of the notes (0-127).
+    - durations (list): Durations of the notes in quarter notes.
+    - ticks_per_quarter (int, optional): The time resolution. Defaults to 10080, as in music21.
+    - velocity (int, optional): The note-on velocity. Defaults to 90, as in music21.
+
+    Returns:
+    - bytes: The MIDI file content.
+    """
+    end_delta = _write_varlen(ticks_per_quarter)
+    conductor = (b'\x00\xff\x51\x03\x07\xa1\x20'  # tempo: 500000 us per quarter note
+                 b'\x00\xff\x58\x04\x04\x02\x18\x08'  # time signature: 4/4
+                 + end_delta + b'\xff\x2f\x00')
+
+    notes = bytearray(b'\x00\xff\x03\x00'  # empty track name
+                      b'\x00\xe0\x00\x40')  # pitch bend centered
+    for pitch, duration in zip(pitches, durations):
+        if not 0 <= pitch <= 127:
+            raise ValueError(f'MIDI pitch {pitch} is out of range; try another first_pitch.')
+        notes += b'\x00' + bytes((0x90, pitch, velocity))
+        notes += _write_varlen(int(round(duration * ticks_per_quarter))) + bytes((0x80, pitch, 0))
+    notes += end_delta + b'\xff\x2f\x00'
+
+    out = bytearray(b'MThd' + struct.pack('>IHHH', 6, 1, 2, ticks_per_quarter))
+    for track in (conductor, notes):
+        out += b'MTrk' + struct.pack('>I', len(track)) + track
+    return bytes(out)
+
+
+def Mel2midi(song,file_path, first_pitch = 69, last_beat=4, engine='music21'):
+    """
+    Converts a Mel2Word encoded melody into a MIDI file.
+
+    Parameters:
+    - song (list): List of Mel2Word encoded tokens.
+    - file_path (str): Path to save the MIDI file.
+    - first_pitch (int): The pitch value for the first note (default is MIDI note 69, middle A).
+    - first_beat (int): The beat value for the first note (default is 1).
+    - last_beat (int): The beat value for the last note (default is 4).
+    - engine (str): 'music21' writes the file through a music21 stream; 'direct' writes the MIDI bytes
+      directly with `write_midi_bytes()`, which is much faster.
+
+    Returns:
+    None
+    """
+    if engine not in ('music21', 'direct'):
+        raise ValueError(f"Unknown MIDI writer engine '{engine}'. Use 'music21' or 'direct'.")
+
+    get_pitch, get_beat = decode_M2W_song(song, first_pitch, last_beat)
+
+    if engine == 'direct':
+        with open(file_path, 'wb') as handle:
+            handle.write(write_midi_bytes(get_pitch, get_beat))
+        print('midifile written to..', file_path)
+        return
+
+    music21 = _import_music21()
+    note, stream, midi = music21.note, music21.stream, music21.midi
+
     notes = []
     for i, pitch_tmp in enumerate(get_pitch):
         n = note.Note(pitch_tmp)
@@ -938,9 +3478,387 @@ def Mel2midi(song,file_path, first_pitch = 69, last_beat=4):
     mf.close()
     print('midifile written to..', file_path)
 
+
+def _render_midi(song, file_name=None, out_dir=None, first_pitch=69, last_beat=4):
+    midi_bytes = write_midi_bytes(*decode_M2W_song(song, first_pitch, last_beat))
+    if out_dir is None:
+        return midi_bytes
+    file_path = join(out_dir, file_name)
+    with open(file_path, 'wb') as handle:
+        handle.write(midi_bytes)
+    return file_path
+
+
+def Mel2midi_batch(songs, out_dir=None, first_pitch=69, last_beat=4, file_names=None, n_jobs=1, chunksize=64):
+    """
+    Converts many Mel2Word encoded melodies into MIDI files (or in-memory MIDI bytes) with the direct writer.
+
+    Parameters:
+    - songs (iterable): Mel2Word token sequences ('M2W_all' or 'token_all'), e.g. `M2WFeatureView(data, 'token_all')`.
+    - out_dir (str, optional): The output directory (created if needed); if None, the MIDI bytes are returned
+      instead of written. Defaults to None.
+    - first_pitch (int): The pitch value for the first note of each melody (default is MIDI note 69, middle A).
+    - last_beat (int): The beat value for the last note of each melody (default is 4).
+    - file_names (list, optional): The file names, one per song. Defaults to '00000.mid', '00001.mid', ...
+    - n_jobs (int): Number of worker processes; 1 converts serially, None uses all CPU cores.
+    - chunksize (int): Number of songs sent to a worker at a time when n_jobs > 1.
+
+    Returns:
+    - list: The written file paths, or the MIDI bytes of each song if `out_dir` is None.
+    """
+    songs = list(songs)
+    if out_dir is not None:
+        os.makedirs(out_dir, exist_ok=True)
+        if file_names is None:
+            file_names = [f'{idx:05d}.mid' for idx in range(len(songs))]
+    else:
+        file_names = [None] * len(songs)
+
+    render = partial(_render_midi, out_dir=out_dir, first_pitch=first_pitch, last_beat=last_beat)
+    if n_jobs == 1:
+        results = list(map(render, songs, file_names))
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            results = list(executor.map(render, songs, file_names, chunksize=chunksize))
+
+    if out_dir is not None:
+        print(len(results), 'midi files written to..', out_dir)
+    else:
+        print(len(results), 'midi files rendered..')
+    return results
+
 """NOTE: Keep in mind that the conversion process involves quantization and the use of relative values, which may result in imperfect restoration. Thus, manual adjustment of the values for the first and last notes may be necessary. Be aware that this function is substandard and may require adjustments to suit your specific research needs.
 
-#Contact
+##Benchmarking
+`run_M2W_benchmark()` times and memory-profiles each stage of the pipeline on `Data_example`, replicated to larger sizes, and writes the results to a JSON file. Results of two versions can be compared with `compare_M2W_benchmarks()`.
+
+To see where the time of a slow job goes, run it inside `with M2WInstrumentation() as stats:` and call `stats.report()`.
+"""
+
+# @title Code for Benchmarking
+
+BENCHMARK_MEASUREMENTS = ('items', 'seconds', 'items_per_second', 'peak_memory_bytes')
+
+
+def _benchmark_stage(results, stage, func, items, repeat=1, memory=True, **params):
+    """
+    Times a pipeline stage (best of `repeat` runs) and measures its peak Python memory allocation in a separate run,
+    since tracing allocations slows the code down. Output printed by the stage is discarded.
+    """
+    times = []
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - start)
+
+    peak_memory = None
+    if memory:
+        tracemalloc.start()
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                func()
+            peak_memory = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    seconds = min(times)
+    result = {'stage': stage, **params, 'items': items, 'seconds': seconds,
+              'items_per_second': items / seconds if seconds > 0 else None, 'peak_memory_bytes': peak_memory}
+    results.append(result)
+
+    memory_str = '' if peak_memory is None else f', peak {peak_memory / 1024 ** 2:.1f} MB'
+    print(f"{stage} {params}: {seconds:.3f}s for {items} items{memory_str}")
+    return result
+
+
+def run_M2W_benchmark(midi_path='Data_example', output='benchmark_results.json', scales=(1, 4),
+                      dic_sizes=(100, 1000, 10000), dictionary_path='Dictionary/Dictionary_all.pkl', engine='music21',
+                      n_jobs=1, bpe_min_freq=2, repeat=1, memory=True):
+    """
+    Benchmarks every stage of the Mel2Word pipeline and writes the results to a JSON file.
+
+    The per-file stages (`get_midi`, `get_M2W`, `tokenize_single_M2W_seq`, `Mel2midi`) run over the files of
+    `midi_path`. The dataset stages (`get_M2W_dataset`, `BPE`, `get_M2W_tokenized_dataset`) also run on the dataset
+    replicated `scale` times; `get_M2W_dataset` reads the replicas through symbolic links in a temporary directory.
+    `BPE` and `get_dictionary_by_length` run at every size of `dic_sizes`.
+
+    Peak memory is measured with `tracemalloc`, so it covers Python allocations of the main process only.
+
+    Parameters:
+    - midi_path (str, optional): The directory containing MIDI files. Defaults to 'Data_example'.
+    - output (str, optional): The output JSON file, or None to only return the results. Defaults to 'benchmark_results.json'.
+    - scales (tuple, optional): Replication factors of the dataset. Defaults to (1, 4).
+    - dic_sizes (tuple, optional): Dictionary sizes for `BPE` and `get_dictionary_by_length`. Defaults to (100, 1000, 10000).
+    - dictionary_path (str, optional): The dictionary used for tokenization. Defaults to 'Dictionary/Dictionary_all.pkl'.
+    - engine (str, optional): MIDI extraction engine ('music21' or 'raw'). Defaults to 'music21'.
+    - n_jobs (int, optional): Number of worker processes for `get_M2W_dataset` and `get_M2W_tokenized_dataset`. Defaults to 1.
+    - bpe_min_freq (int, optional): The `min_freq` of `BPE`, low enough for the larger `dic_sizes` to be reached. Defaults to 2.
+    - repeat (int, optional): Number of timed runs per stage; the fastest is reported. Defaults to 1.
+    - memory (bool, optional): Whether to measure peak memory (one extra run per stage). Defaults to True.
+
+    Returns:
+    - dict: The environment ('meta') and one record per stage and setting ('results').
+    """
+    onlyfiles = sorted([f for f in listdir(midi_path) if isfile(join(midi_path, f))])
+    midi_files = [join(midi_path, f) for f in onlyfiles]
+    results = []
+    bench = partial(_benchmark_stage, results, repeat=repeat, memory=memory)
+
+    melodies = []
+
+    def read_melodies():
+        melodies[:] = [get_midi(f, engine=engine) for f in midi_files]
+
+    bench('get_midi', read_melodies, len(midi_files), engine=engine)
+    bench('get_M2W', lambda: [get_M2W_features(melody) for melody in melodies], len(melodies), engine=engine)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        dataset = get_M2W_dataset(midi_path, engine=engine, n_jobs=n_jobs)
+        dictionary = load_dictionary(dictionary_path)
+
+    for dic_size in dic_sizes:
+        bench('get_dictionary_by_length', lambda: get_dictionary_by_length(dictionary, dic_size), len(dictionary),
+              dic_size=dic_size)
+
+    dic = get_dictionary_by_length(dictionary, dic_sizes[0]) if dic_sizes else dictionary
+    bench('tokenize_single_M2W_seq', lambda: [tokenize_single_M2W_seq(dic, midi['M2W_all']) for midi in dataset],
+          len(dataset), dic_size=dic_sizes[0] if dic_sizes else None)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        bench('Mel2midi', lambda: [Mel2midi(midi['M2W_all'], join(tmp_dir, f'{idx}.mid')) for idx, midi in enumerate(dataset)],
+              len(dataset))
+
+    for scale in scales:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for copy_idx in range(scale):
+                for midi_name in onlyfiles:
+                    os.symlink(os.path.abspath(join(midi_path, midi_name)), join(tmp_dir, f'{copy_idx:03d}_{midi_name}'))
+            bench('get_M2W_dataset', lambda: get_M2W_dataset(tmp_dir, engine=engine, n_jobs=n_jobs),
+                  len(onlyfiles) * scale, scale=scale, engine=engine, n_jobs=n_jobs)
+
+        data = [dict(midi, f_name=f'{copy_idx:03d}_{midi["f_name"]}') for copy_idx in range(scale) for midi in dataset]
+        for dic_size in dic_sizes:
+            bench('BPE', lambda: BPE([dict(midi) for midi in data], feat=3, dic_size=dic_size, min_freq=bpe_min_freq),
+                  len(data), scale=scale, dic_size=dic_size)
+        for dic_size in dic_sizes:
+            bench('get_M2W_tokenized_dataset',
+                  lambda: get_M2W_tokenized_dataset(data, dictionary, feat=3, dic_size=dic_size, n_jobs=n_jobs),
+                  len(data), scale=scale, dic_size=dic_size, n_jobs=n_jobs)
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    report = {'meta': {'commit': commit,
+                       'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                       'python': platform.python_version(),
+                       'numpy': np.__version__,
+                       'platform': platform.platform(),
+                       'cpu_count': os.cpu_count(),
+                       'midi_path': midi_path,
+                       'n_files': len(onlyfiles),
+                       'repeat': repeat},
+              'results': results}
+
+    if output is not None:
+        with open(output, 'w') as handle:
+            json.dump(report, handle, indent=2)
+        print('Benchmark results written to..', output)
+    return report
+
+
+def compare_M2W_benchmarks(baseline, current, tolerance=0.2):
+    """
+    Compares two benchmark reports of `run_M2W_benchmark()` and lists the stages that got slower.
+
+    Parameters:
+    - baseline (str or dict): The baseline report (or its JSON file).
+    - current (str or dict): The report to check (or its JSON file).
+    - tolerance (float, optional): The allowed relative slowdown. Defaults to 0.2 (20%).
+
+    Returns:
+    - list: (stage settings, baseline seconds, current seconds) of each stage slower than allowed.
+    """
+    reports = []
+    for report in (baseline, current):
+        if isinstance(report, str):
+            with open(report) as handle:
+                report = json.load(handle)
+        reports.append({tuple(sorted((k, v) for k, v in result.items() if k not in BENCHMARK_MEASUREMENTS)): result
+                        for result in report['results']})
+
+    regressions = []
+    for key, result in reports[1].items():
+        base_result = reports[0].get(key)
+        if base_result is None:
+            continue
+        ratio = result['seconds'] / base_result['seconds'] if base_result['seconds'] > 0 else 1.0
+        print(f"{dict(key)}: {base_result['seconds']:.3f}s -> {result['seconds']:.3f}s ({ratio:.2f}x)")
+        if ratio > 1 + tolerance:
+            regressions.append((dict(key), base_result['seconds'], result['seconds']))
+
+    print(f'{len(regressions)} of {len(reports[1])} stages are slower than the {tolerance:.0%} tolerance.')
+    return regressions
+
+
+# Instrumented stages and the argument whose length is the number of items they process (None: the result)
+INSTRUMENTED_STAGES = {'get_midi': None,
+                       'get_pitch_interval': 'melody',
+                       'get_IOI': 'melody',
+                       'get_bped_word': 'db',
+                       'encode_bytepair': 'seq',
+                       'merge_bytepairs_incremental': 'db',
+                       '_BPEShard.melody_pairs': 'seq',
+                       'encode_bytepair_ids': 'seq',
+                       'tokenize_single_M2W_seq': 'M2W',
+                       'tokenize_M2W_seq_with_trie': 'M2W'}
+
+
+class M2WInstrumentation:
+    """
+    Opt-in per-stage instrumentation of the pipeline, used as a context manager.
+
+    While active, the functions of `INSTRUMENTED_STAGES` are replaced in this module by wrappers that record the wall
+    time, number of calls, items processed and (with `memory=True`) the peak memory allocated during a call of each
+    stage; 'Class.method' stages are replaced on their class. For the default BPE engine, '_BPEShard.melody_pairs' is
+    the pair counting, 'encode_bytepair_ids' the merging, and 'merge_bytepairs_incremental' the whole merge loop.
+    The original functions are restored on exit, so there is no cost when instrumentation is not active. Calls made in
+    worker processes (`n_jobs` > 1, the 'sharded' BPE engine) are not recorded.
+
+    Parameters:
+    - callback (callable, optional): Called after every call of a stage as `callback(stage, seconds, items, peak_memory)`
+      (peak_memory is None without `memory`). Defaults to None.
+    - logger (logging.Logger, optional): Logger for `report()`; the report is printed if None. Defaults to None.
+    - memory (bool, optional): Whether to trace memory allocations with `tracemalloc`, which slows the code down.
+      Defaults to False.
+
+    Example:
+        with M2WInstrumentation() as stats:
+            data = get_M2W_dataset('Data_example')
+        stats.report()
+    """
+
+    _active = None
+
+    def __init__(self, callback=None, logger=None, memory=False):
+        self.callback = callback
+        self.logger = logger
+        self.memory = memory
+        self.stats = {stage: {'calls': 0, 'seconds': 0.0, 'items': 0, 'peak_memory_bytes': None}
+                      for stage in INSTRUMENTED_STAGES}
+        self._originals = {}
+        self._memory_frames = []
+        self._started_tracemalloc = False
+
+    def _wrap(self, stage, func):
+        arg_name = INSTRUMENTED_STAGES[stage]
+        arg_pos = None if arg_name is None else list(inspect.signature(func).parameters).index(arg_name)
+        record = self._record
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if self.memory:
+                self._memory_frames.append([tracemalloc.get_traced_memory()[0], 0])
+                tracemalloc.reset_peak()
+            result = None
+            start = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+                return result
+            finally:
+                seconds = time.perf_counter() - start
+                if arg_pos is None:
+                    items = len(result) if result is not None else 0
+                else:
+                    items = len(args[arg_pos] if len(args) > arg_pos else kwargs[arg_name])
+                record(stage, seconds, items)
+
+        return wrapper
+
+    def _record(self, stage, seconds, items):
+        peak_memory = None
+        if self.memory:
+            start_memory, child_peak = self._memory_frames.pop()
+            peak = max(tracemalloc.get_traced_memory()[1], child_peak)
+            if self._memory_frames:
+                self._memory_frames[-1][1] = max(self._memory_frames[-1][1], peak)
+            peak_memory = peak - start_memory
+
+        stat = self.stats[stage]
+        stat['calls'] += 1
+        stat['seconds'] += seconds
+        stat['items'] += items
+        if peak_memory is not None:
+            stat['peak_memory_bytes'] = max(stat['peak_memory_bytes'] or 0, peak_memory)
+
+        if self.callback is not None:
+            self.callback(stage, seconds, items, peak_memory)
+
+    def __enter__(self):
+        if M2WInstrumentation._active is not None:
+            raise RuntimeError('Another M2WInstrumentation is already active.')
+        M2WInstrumentation._active = self
+
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+
+        for stage in INSTRUMENTED_STAGES:
+            owner, name = self._owner(stage)
+            self._originals[stage] = owner[name] if isinstance(owner, dict) else getattr(owner, name)
+            self._set(stage, self._wrap(stage, self._originals[stage]))
+        return self
+
+    @staticmethod
+    def _owner(stage):
+        # A stage is a function of this module, or a 'Class.method' of one of its classes
+        if '.' in stage:
+            class_name, name = stage.split('.')
+            return globals()[class_name], name
+        return globals(), stage
+
+    def _set(self, stage, func):
+        owner, name = self._owner(stage)
+        if isinstance(owner, dict):
+            owner[name] = func
+        else:
+            setattr(owner, name, func)
+
+    def __exit__(self, *exc_info):
+        for stage, func in self._originals.items():
+            self._set(stage, func)
+        self._originals = {}
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+        M2WInstrumentation._active = None
+        return False
+
+    def summary(self):
+        """
+        Returns:
+        - dict: For each stage that was called, its calls, total seconds, items, items per second and peak memory.
+        """
+        return {stage: {**stat, 'items_per_second': stat['items'] / stat['seconds'] if stat['seconds'] > 0 else None}
+                for stage, stat in self.stats.items() if stat['calls']}
+
+    def report(self):
+        """
+        Prints (or logs, if a logger was given) one line per stage that was called.
+        """
+        for stage, stat in self.summary().items():
+            memory_str = '' if stat['peak_memory_bytes'] is None else f", peak {stat['peak_memory_bytes'] / 1024 ** 2:.1f} MB"
+            line = f"{stage}: {stat['calls']} calls, {stat['seconds']:.3f}s, {stat['items']} items{memory_str}"
+            if self.logger is not None:
+                self.logger.info(line)
+            else:
+                print(line)
+
+
+"""#Contact
 
 If you have any issues, inquiries, or are interested in collaborative research, please feel free to contact us at saebyulsb@gmail.com
 """